@@ -0,0 +1,80 @@
+'''Startup time of conectsim.
+
+Measures, in a fresh interpreter each time, the time to import
+each module and the time to run conectsim --version.
+'''
+
+from __future__ import print_function
+
+import sys
+import argparse
+import subprocess
+
+MODULES = [
+    'yaml',
+    'numpy',
+    'scipy.interpolate',
+    'scipy.ndimage',
+    'scipy.sparse',
+    'astropy.io.fits',
+    'conectsim.user',
+    'conectsim.control',
+    'conectsim.detector',
+    'conectsim.instrument',
+    'conectsim.builder',
+]
+
+IMPORT = '''
+import time
+t0 = time.time()
+import %s
+print(time.time() - t0)
+'''
+
+CLI = '''
+import time
+t0 = time.time()
+import conectsim.user
+try:
+    conectsim.user.main(['--version'])
+except SystemExit:
+    pass
+print(time.time() - t0)
+'''
+
+
+def measure(code, repeat):
+    '''Best time of running code in repeat fresh interpreters.'''
+    times = []
+    for _ in range(repeat):
+        proc = subprocess.Popen([sys.executable, '-c', code],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            return None
+        times.append(float(out.split()[-1]))
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of conectsim')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of runs of each measurement')
+    parser.add_argument('modules', nargs='*', default=MODULES,
+                        help='Modules to import')
+    args = parser.parse_args()
+
+    for name in args.modules:
+        elapsed = measure(IMPORT % name, args.repeat)
+        if elapsed is None:
+            print('%-30s   failed' % name)
+        else:
+            print('%-30s %8.1f ms' % (name, elapsed * 1000))
+    elapsed = measure(CLI, args.repeat)
+    if elapsed is None:
+        print('%-30s   failed' % 'conectsim --version')
+    else:
+        print('%-30s %8.1f ms' % ('conectsim --version', elapsed * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+
+'''Caches for derived simulation products.'''
+
+from collections import OrderedDict
+
+
+class Cache(object):
+    '''A mapping that computes missing values on demand.
+
+    If maxsize is not None, the least recently used entries
+    are discarded when the cache grows over maxsize.
+    '''
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, factory):
+        '''Return the value for key, calling factory() if missing.'''
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            value = factory()
+        else:
+            self.hits += 1
+        self._data[key] = value
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def info(self):
+        '''Return hits, misses and current size.'''
+        return self.hits, self.misses, len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+def freeze(obj):
+    '''Convert nested dicts and lists into a hashable value.'''
+    if isinstance(obj, dict):
+        return tuple(sorted((key, freeze(value)) for key, value in obj.items()))
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(value) for value in obj)
+    return obj
@@ -2,11 +2,16 @@
 from __future__ import division
 from __future__ import print_function
 
+import os
 import logging
-import copy
 from datetime import datetime
 
-#from numina.treedict import TreeDict
+from .writer import WriterPool, FramePool
+from .fitsout import write_int16, write_compressed
+from .fitsout import create_container, append_frame
+
+from .treedict import TreeDict
+from .parallel import run_parallel
 
 _logger = logging.getLogger('control')
 
@@ -22,11 +27,111 @@ def name_generator(name='r%05d.fits', start=1):
         yield name % idx
         idx += 1
 
+def write_fits(hdul, filename):
+    hdul[0].scale('int16', bzero=32768)
+    hdul.writeto(filename, overwrite=True)
+
+def _update_meta(meta, instrument, metavars):
+    '''Update meta for a read of instrument.'''
+    # Only the parts of the instrument that changed are rebuilt
+    meta[instrument.name] = instrument.config_info()
+    meta['control.date'] = datetime.utcnow().isoformat()
+    meta['control.runid'] = 1 #FIXME, this was self.current_obs_block.id
+    meta['ob.object'] = metavars['template'].format(**metavars)
+
+def _image_output(output, filename, instrument, meta, data, memmap=False,
+                  compression='RICE_1'):
+    '''Return func, args; func(*args) writes data, the reads of an exposure.'''
+    frame = data[0]
+    if output == 'compressed':
+        header = instrument.header(meta)
+        return write_compressed, (filename, header, frame, compression)
+    elif output == 'int16' and frame.dtype == 'uint16':
+        header = instrument.header(meta)
+        return write_int16, (filename, header, frame, memmap)
+    hdul = instrument.factory(meta, data)
+    return write_fits, (hdul, filename)
+
+class _ParallelWriter(object):
+    '''Write the images of parallel_run in the worker processes.
+
+    In container mode, the frames are appended in order by
+    the control system, the writer returns their headers.
+    '''
+    def __init__(self, destdir, output, memmap, compression):
+        self.destdir = destdir
+        self.output = output
+        self.memmap = memmap
+        self.compression = compression
+
+    def __call__(self, instrument, reads, task):
+        meta, names = task
+        metavars = {'repeat': 1, 'template': meta['ob.object']}
+        result = []
+        for idx, data in enumerate(reads):
+            name = names[idx]
+            _update_meta(meta, instrument, metavars)
+            if self.output == 'container':
+                result.append((instrument.header(meta), data[0]))
+            else:
+                filename = os.path.join(self.destdir, name)
+                func, args = _image_output(self.output, filename, instrument, meta,
+                                           data, self.memmap, self.compression)
+                func(*args)
+                result.append(name)
+            metavars['repeat'] += 1
+        return result
+
+def _releasing(func, frames, frame):
+    '''Call func, and return frame to the pool frames.'''
+    def write(*args):
+        try:
+            func(*args)
+        finally:
+            frames.release(frame)
+    return write
+
 class ControlSystem(object):
-    def __init__(self, destdir):
+    '''Run the exposures and store the images.
+
+    The FITS files are written by nwriters background threads.
+    If callback is not None, callback(name, error) is called
+    when each file is written, see WriterPool.
+
+    The reads of the detector go to max_frames preallocated frames,
+    so at most max_frames frames are in memory waiting to be written;
+    the exposures wait for a free frame.
+
+    The output modes are:
+
+    * 'int16', the uint16 frames of the detector are streamed into
+      the files, optionally through a memory map.
+    * 'fits', the files are written by astropy from a HDUList.
+    * 'compressed', tile compressed files, with the given compression
+      ('RICE_1', 'HCOMPRESS_1'...), compressed by the writer threads.
+    * 'container', the frames of each observing block (or of each run
+      outside observing blocks) are appended as extensions to one file.
+    '''
+    def __init__(self, destdir, nwriters=2, callback=None, output='int16', memmap=False,
+                 compression='RICE_1', max_frames=4):
         self.ng = name_generator()
+        self.cng = name_generator('c%05d.fits')
         self.destdir = destdir
-        self.meta = {} #TreeDict()
+        self.output = output
+        self.memmap = memmap
+        self.compression = compression
+        # The reads of the detector go to a pool of max_frames
+        # frames, reused once written. The run waits while all
+        # of them are waiting to be written
+        self.max_frames = max(1, max_frames)
+        self._frames = None
+        self.writer = WriterPool(nworkers=nwriters, maxsize=self.max_frames,
+                                 callback=callback)
+        # A single thread appends to the container, in order
+        self.appender = WriterPool(nworkers=1, maxsize=self.max_frames,
+                                   callback=callback)
+        self._container = None
+        self.meta = TreeDict()
         self.meta['ob'] = {'observer': 'SIMULATOR', 'object': 'FOCUS', 'mode': 'ENGINEERING'}
         self.meta['pointing'] = {'airmass': 1.0,  'dec': '10:01:04.000', 'ra': '04:05:00.40'}
         self.meta['proposal'] = {'id': 100,  'pi_id': 0}
@@ -60,10 +165,14 @@ class ControlSystem(object):
         _logger.info('starting observing block %i', self.current_obs_block.id)
         oblock = self.current_obs_block
         oblock.start_time = datetime.utcnow()
+        if self.output == 'container':
+            self.open_container('ob%05d.fits' % oblock.id)
 
     def end_ob(self):
         oblock = self.current_obs_block
         oblock.completion_time = datetime.utcnow()
+        if self._container is not None:
+            self.close_container()
         _logger.info('ending observing block')
         self.current_obs_block = None
         return oblock
@@ -76,52 +185,158 @@ class ControlSystem(object):
         #instrument.pre()
         pass
 
+    def frame_pool(self, instrument):
+        '''The pool of frames for the reads of the detector of instrument.'''
+        detector = instrument.detector
+        shape = (detector.size_y, detector.size_x)
+        if self._frames is None or self._frames.shape != shape:
+            self._frames = FramePool(shape, 'uint16', self.max_frames)
+        return self._frames
+
     def _run(self, instrument, exposure):
+        das = getattr(instrument, 'das', None)
+        if das is None:
+            return self._run_frames(instrument, instrument.run(exposure), None)
+        das.frames = self.frame_pool(instrument)
+        try:
+            return self._run_frames(instrument, instrument.run(exposure), das.frames)
+        finally:
+            # The pool cannot be pickled with the instrument
+            das.frames = None
+
+    def _run_parallel(self, instrument, exposure, nimages, jobs):
+        # The names of the images are assigned here, in order
+        meta = self.meta.snapshot()
+        nreads = instrument.das.reads(exposure)
+        tasks = [(meta, [self.ng.next() for _ in range(nreads)])
+                 for _ in range(nimages)]
+        write = _ParallelWriter(self.destdir, self.output, self.memmap,
+                                self.compression)
         names = []
-        meta = copy.deepcopy(self.meta)
-        meta[instrument.name] = instrument.config_info()
-        ob = meta['ob']
-        control = meta['control']
-        #metavars = {'repeat': 1, 'template': meta['ob.object']}
-        metavars = {'repeat': 1, 'template': ob['object']}
-        for data in instrument.run(exposure):
+        results = run_parallel(instrument, exposure, tasks, jobs, write)
+        for (_, image), result in zip(tasks, results):
+            if self.output == 'container':
+                for name, (header, frame) in zip(image, result):
+                    self.appender.submit(name, append_frame, self._container,
+                                         header, frame, name)
+                names.extend(self._output_name(name) for name in image)
+            else:
+                names.extend(result)
+        return names
+
+    def _run_frames(self, instrument, reads, frames):
+        names = []
+        # A copy on write snapshot of the metadata
+        meta = self.meta.snapshot()
+        metavars = {'repeat': 1, 'template': meta['ob.object']}
+        for data in reads:
             name = self.ng.next()
-            names.append(name)
+            names.append(self._output_name(name))
             # Update metadata    
-            #meta['control.date'] = datetime.utcnow().isoformat()
-            #meta['control.runid'] = self.current_obs_block.id
-            #meta['ob.object'] = metavars['template'].format(**metavars)
-            control['date'] = datetime.utcnow().isoformat()
-            control['runid'] = 1 #FIXME, this was self.current_obs_block.id
-
-            #meta['ob.object'] = metavars['template'].format(**metavars)
-            ob['object'] = metavars['template'].format(**metavars)
+            _update_meta(meta, instrument, metavars)
 
             #_logger.info('runid=%s object=%r imagetype=%s obstype=%s readoutmode=%s' % (meta['control.runid'], meta['ob.object'], meta['emir.imagetype'], meta['emir.obstype'], instrument.das.mode.mode))
             #tslr = instrument.das.detector.time_since_last_reset()
 
-            self.build_fits(name, instrument, meta, data)
+            self.build_fits(name, instrument, meta, data, frames)
             metavars['repeat'] += 1
         return names
 
-    def build_fits(self, name, instrument, meta, data):
-        hdul = instrument.factory(meta, data)
-        hdul[0].scale('int16', bzero=32768)
-        hdul.writeto(self.destdir + '/' + name, clobber=True)
+    def _output_name(self, name):
+        if self.output == 'container':
+            return os.path.basename(self._container), name
+        return name
+
+    def path(self, name):
+        '''Absolute path of an image returned by run.
+
+        In container mode, the pair (path of the container, extension).
+        '''
+        if isinstance(name, tuple):
+            container, extension = name
+            return os.path.join(self.destdir, container), extension
+        return os.path.join(self.destdir, name)
+
+    def open_container(self, name):
+        '''Start appending the frames to the container name.'''
+        self._container = os.path.join(self.destdir, name)
+        self.appender.submit(name, create_container, self._container)
+
+    def close_container(self):
+        self._container = None
+        self.flush()
+
+    def build_fits(self, name, instrument, meta, data, frames=None):
+        '''Queue the writing of data, the reads of an exposure.
+
+        If frames is not None, the frame is returned to
+        the pool frames once it is written.
+        '''
+        filename = os.path.join(self.destdir, name)
+        frame = data[0]
+        if self.output == 'container':
+            header = instrument.header(meta)
+            func, args = append_frame, (self._container, header, frame, name)
+        else:
+            func, args = _image_output(self.output, filename, instrument, meta,
+                                       data, self.memmap, self.compression)
+        if frames is not None:
+            func = _releasing(func, frames, frame)
+        writer = self.appender if self.output == 'container' else self.writer
+        writer.submit(name, func, *args)
+
+    def flush(self):
+        '''Wait until all the images are written.'''
+        errors = self.writer.flush() + self.appender.flush()
+        if errors:
+            raise IOError('%d files could not be written: %s' %
+                          (len(errors), ', '.join(name for name, _ in errors)))
 
     def post(self, instrument):
         #instrument.post()
         pass
 
+    def _run_and_flush(self, run, instrument, *args):
+        if self.output == 'container' and self._container is None:
+            # One container for this run
+            self.open_container(self.cng.next())
+            try:
+                return run(instrument, *args)
+            finally:
+                self.close_container()
+        names = run(instrument, *args)
+        self.flush()
+        return names
+
     def mode_run(self, instrument, mode):
         self.pre(instrument)
-        names = self._run(instrument, mode.exposure)
+        names = self._run_and_flush(self._run, instrument, mode.exposure)
         self.post(instrument)
         return names
 
     def run(self, instrument, exposure):
+        '''Run an exposure and write its images.
+
+        Returns the names of the images, the files in destdir.
+        In container mode, the images are extensions of a
+        container, and each name is the pair (container, extension).
+        '''
+        self.pre(instrument)
+        names = self._run_and_flush(self._run, instrument, exposure)
+        self.post(instrument)
+        return names
+
+    def parallel_run(self, instrument, exposure, nimages, jobs):
+        '''Run nimages exposures in jobs processes, see run_parallel.
+
+        The images are the ones of nimages calls to run, and they are
+        written in the same way, by the worker processes. In container
+        mode, they go to a single container if no observing block is
+        open, and the frames are sent back to be appended in order.
+        '''
         self.pre(instrument)
-        names = self._run(instrument, exposure)
+        names = self._run_and_flush(self._run_parallel, instrument, exposure,
+                                    nimages, jobs)
         self.post(instrument)
         return names
 
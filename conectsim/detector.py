@@ -1,32 +1,162 @@
 '''Module to handle the detector.'''
 
+from __future__ import division
+
 import logging
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
 
 from conectsim.optics.basenodes import Sink
 from conectsim.devices.device import Device
 
 _logger = logging.getLogger('connectsim.detector')
 
+# Range of the values of the detector array
+ADU_MAX = 65535
+
+
+class NoiseModel(object):
+    '''Noise of the detector.
+
+    The random numbers are generated in blocks of rows. Each block
+    draws from its own stream, seeded with (seed, stream, block),
+    so that the result does not depend on the number of threads.
+    '''
+    def __init__(self, gain=1.0, bias=1000.0, ron=2.0, dark=0.0,
+                 fullwell=200000.0, seed=None, nthreads=1, block_rows=256):
+        self.gain = gain # electrons per ADU
+        self.bias = bias # ADU
+        self.ron = ron # electrons
+        self.dark = dark # electrons per second
+        self.fullwell = fullwell # electrons
+        if seed is None:
+            seed = np.random.RandomState().randint(2**31)
+        self.seed = seed
+        self.nthreads = nthreads
+        self.block_rows = block_rows
+
+    def _random(self, stream, block):
+        return np.random.RandomState([self.seed, stream, block])
+
+    def _map(self, func, nrows):
+        blocks = [(idx, start, min(start + self.block_rows, nrows))
+                  for idx, start in enumerate(range(0, nrows, self.block_rows))]
+        if self.nthreads > 1 and len(blocks) > 1:
+            # The threads end with the call, none is left behind,
+            # also in the processes forked with the detector
+            pool = ThreadPool(min(self.nthreads, len(blocks)))
+            try:
+                pool.map(func, blocks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for block in blocks:
+                func(block)
+
+    def add_charge(self, charge, rate, exptime, stream):
+        '''Add to charge the electrons collected in exptime seconds.
+
+        rate is the illumination in photons per second, or None.
+        The charge saturates at the full well capacity.
+        '''
+        if rate is None and self.dark * exptime <= 0:
+            # Nothing to collect
+            return
+
+        def add_block(block):
+            idx, start, end = block
+            random = self._random(stream, idx)
+            if rate is None:
+                expected = np.empty((end - start, charge.shape[1]))
+                expected.fill(self.dark * exptime)
+            else:
+                expected = rate[start:end] * exptime
+                expected += self.dark * exptime
+                np.maximum(expected, 0.0, out=expected)
+            collected = charge[start:end]
+            collected += random.poisson(expected)
+            np.minimum(collected, self.fullwell, out=collected)
+
+        self._map(add_block, charge.shape[0])
+
+    def read(self, charge, stream, out):
+        '''Read the charge into out, an uint16 array.
+
+        The values include the read noise and the bias, and
+        saturate at the range of the detector array.
+        '''
+        def read_block(block):
+            idx, start, end = block
+            random = self._random(stream, idx)
+            adu = random.normal(0.0, self.ron, size=(end - start, charge.shape[1]))
+            adu += charge[start:end]
+            adu /= self.gain
+            adu += self.bias
+            np.rint(adu, out=adu)
+            np.clip(adu, 0, ADU_MAX, out=adu)
+            out[start:end] = adu
+
+        self._map(read_block, charge.shape[0])
+
 
 class CDetector(Sink, Device):
-    def __init__(self, size_x, size_y, pixel_size, qe):
+    def __init__(self, size_x, size_y, pixel_size, qe, gain=1.0, bias=1000.0,
+                 ron=2.0, dark=0.0, fullwell=200000.0, seed=None, nthreads=1):
         Sink.__init__(self)
         Device.__init__(self, name='detector')
         self.size_x = size_x
         self.size_y = size_y
         self.pixel_size = pixel_size # pixel size in microns
         self.qe = qe
+        # The quantum efficiency, a number or a function of the wavelength
+        self.transmission_interp = qe
+        self.noise = NoiseModel(gain=gain, bias=bias, ron=ron, dark=dark,
+                                fullwell=fullwell, seed=seed, nthreads=nthreads)
+        self.input_image = None
+        # Charge collected since the last reset
+        self._charge = None
+        self._time = 0.0
+        # Index of the next random stream
+        self._stream = 0
 
     def set_input(self, input_image):
+        '''Set the image illuminating the detector, in photons per second.'''
         self.input_image = input_image
 
-    def expose(self, exptime):
-        _logger.debug('Generating poisson noise')
+    def _next_stream(self):
+        self._stream += 1
+        return self._stream
+
+    def reset(self):
+        '''Empty the detector.'''
+        if self._charge is None:
+            self._charge = np.zeros((self.size_y, self.size_x))
+        else:
+            self._charge.fill(0.0)
+        self._time = 0.0
 
+    def integrate(self, exptime):
+        '''Collect the illumination during exptime seconds.'''
+        _logger.debug('Generating poisson noise')
+        self.noise.add_charge(self._charge, self.input_image, exptime, self._next_stream())
+        self._time += exptime
         _logger.debug('Poisson noise generated')
-        
+
+    def readout(self, out=None):
+        '''Read the detector array, without resetting it.'''
         _logger.debug('Reading detector array')
+        if out is None:
+            out = np.empty((self.size_y, self.size_x), dtype='uint16')
+        self.noise.read(self._charge, self._next_stream(), out)
         _logger.debug('Detector array read')
-        _logger.debug('Saturation start.')
-        _logger.debug('Saturation end')
-        return 0.0
\ No newline at end of file
+        return out
+
+    def time_since_last_reset(self):
+        return self._time
+
+    def expose(self, exptime):
+        self.reset()
+        self.integrate(exptime)
+        return self.readout()
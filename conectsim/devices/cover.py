@@ -23,18 +23,21 @@ class HemiCover(ConnectableDevice):
     def open(self):
         if self._pos == 0:
             self._pos = 1
+            self.touch()
             self.changed.emit(self._pos)
             self.opened.emit()
 
     def close(self):
         if self._pos == 1:
             self._pos = 0
+            self.touch()
             self.changed.emit(self._pos)
             self.closed.emit()
 
     def flip(self):
         self._pos += 1
         self._pos %= 2
+        self.touch()
         self.changed.emit(self._pos)
         if self._pos == 1:
             self.opened.emit()
@@ -44,7 +47,7 @@ class HemiCover(ConnectableDevice):
     def pos(self):
         return self._pos
     
-    def config_info(self):
+    def _config_info(self):
         return {'name': self.name, 'position': self._pos, 
                 'label': self.NAMES[self._pos]}
 
@@ -93,7 +96,7 @@ class FullCover(ConnectableDevice):
     def pos(self):
         return 2 * self.left.pos() + self.right.pos()
      
-    def config_info(self):
+    def _config_info(self):
         return {'name': self.name, 'position': self.pos()}   
 
 
@@ -119,8 +122,8 @@ class C_Cover(FullCover):
             pos = self.NAMES[mode]
             super(C_Cover, self).set(pos)
     
-    def config_info(self):
-        res = super(C_Cover, self).config_info()
+    def _config_info(self):
+        res = super(C_Cover, self)._config_info()
 
         my_pos = res['position']
 
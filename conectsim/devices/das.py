@@ -6,37 +6,157 @@ from datetime import datetime
 
 from conectsim.devices.device import Device
 
+_logger = logging.getLogger('connectsim.das')
+
+
+class ReadoutMode(object):
+    '''A single read at the end of the exposure.'''
+    mode = 'single'
+
+    def sequence(self, exposure):
+        '''Yield the operations of an exposure.
+
+        Each operation is a pair (time, op), time is the
+        integration time since the previous operation.
+        '''
+        yield 0.0, 'reset'
+        yield exposure, 'read'
+
+
+class CDSMode(ReadoutMode):
+    '''Correlated double sampling, a read after the reset and at the end.'''
+    mode = 'cds'
+
+    def sequence(self, exposure):
+        yield 0.0, 'reset'
+        yield 0.0, 'read'
+        yield exposure, 'read'
+
+
+class FowlerMode(ReadoutMode):
+    '''Fowler sampling, reads groups of reads after the reset and at the end.
+
+    The exposure is the time between the first reads of each group.
+    '''
+    mode = 'fowler'
+
+    def __init__(self, reads, readtime=0.0):
+        self.reads = reads
+        self.readtime = readtime
+
+    def sequence(self, exposure):
+        group = (self.reads - 1) * self.readtime
+        if exposure < group:
+            raise ValueError('exposure shorter than a group of %d reads' % self.reads)
+        yield 0.0, 'reset'
+        yield 0.0, 'read'
+        for _ in range(self.reads - 1):
+            yield self.readtime, 'read'
+        yield exposure - group, 'read'
+        for _ in range(self.reads - 1):
+            yield self.readtime, 'read'
+
+
+class RampMode(ReadoutMode):
+    '''Up the ramp sampling, reads equally spaced during the exposure.'''
+    mode = 'ramp'
+
+    def __init__(self, reads):
+        if reads < 2:
+            raise ValueError('a ramp requires at least 2 reads')
+        self.reads = reads
+
+    def sequence(self, exposure):
+        step = exposure / (self.reads - 1)
+        yield 0.0, 'reset'
+        yield 0.0, 'read'
+        for _ in range(self.reads - 1):
+            yield step, 'read'
+
+
+_READOUT_MODES = {'single': ReadoutMode, 'cds': CDSMode,
+                  'fowler': FowlerMode, 'ramp': RampMode}
+
+
+def readout_mode(conf):
+    '''Create a readout mode from its name or a dictionary.
+
+    The dictionary contains the name of the mode in 'mode' and
+    the rest of the arguments of the mode, i.e. {'mode': 'ramp', 'reads': 30}
+    '''
+    if isinstance(conf, basestring):
+        conf = {'mode': conf}
+    args = dict(conf)
+    name = args.pop('mode')
+    try:
+        cls = _READOUT_MODES[name]
+    except KeyError:
+        raise ValueError('Not allowed readout mode %s' % name)
+    return cls(**args)
+
 
 class DataAdquisitionSystem(Device):
-    def __init__(self, detector):
+    def __init__(self, detector, mode=None):
         super(DataAdquisitionSystem, self).__init__(name='das')
         self.detector = detector
+        self.mode = mode or ReadoutMode()
         self.meta = {}
-    #    f1 = self.detector.readout
-    #    f2 = self.detector.reset
-    #    self.ops = {'read': f1, 'reset': f2}
-        
+        # Methods of the detector run by each operation, by name
+        # so that the system can be pickled
+        self.ops = {'read': 'readout', 'reset': 'reset'}
+        # If not None, a pool of preallocated frames for the reads
+        self.frames = None
+
         now = datetime.now()
         self.meta['dateobs'] = now.isoformat()
         #self.meta['mjdobs'] = datetime_to_mjd(now)
         self.meta['elapsed'] = 0
         self.meta['darktime'] = 0
-        
-    def config_info(self):
-        return self.meta
+        self.meta['readmode'] = self.mode.mode
+
+    def _config_info(self):
+        return dict(self.meta)
+
+    def configure(self, meta):
+        self.mode = readout_mode(meta)
+        self.meta['readmode'] = self.mode.mode
+        self.touch()
+
+    def streams(self, exposure):
+        '''Number of random streams of the detector used by an exposure.'''
+        # A stream for each integration and for each read
+        return sum((time > 0) + (op == 'read')
+                   for time, op in self.mode.sequence(exposure))
+
+    def reads(self, exposure):
+        '''Number of reads of an exposure.'''
+        return sum(op == 'read' for _, op in self.mode.sequence(exposure))
 
     def pre(self):
         pass
 
     def post(self):
         pass
-    
+
     def run(self, exposure):
+        '''Run the exposure, yielding each read as it is done.
+
+        The reads are non destructive, the detector keeps the
+        charge between them.
+        '''
         now = datetime.now()
         self.meta['dateobs'] = now.isoformat()
-        data = self.detector.expose(exposure)
-        #    _logger.info('at %s %s %s', time, self.detector.time_since_last_reset(), op)
-        #    self.meta['elapsed'] = self.detector.time_since_last_reset()
-        #    self.meta['darktime'] = self.detector.time_since_last_reset()
-        yield data
-
+        self.touch()
+        for time, op in self.mode.sequence(exposure):
+            if time > 0:
+                self.detector.integrate(time)
+            if op == 'read' and self.frames is not None:
+                result = self.detector.readout(out=self.frames.get())
+            else:
+                result = getattr(self.detector, self.ops[op])()
+            _logger.debug('at %s %s %s', time, self.detector.time_since_last_reset(), op)
+            if op == 'read':
+                self.meta['elapsed'] = self.detector.time_since_last_reset()
+                self.meta['darktime'] = self.detector.time_since_last_reset()
+                self.touch()
+                yield result
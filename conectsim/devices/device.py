@@ -1,7 +1,7 @@
-from conectsim.optics.basenodes import Node, Source
+from conectsim.optics.basenodes import Node, Source, invalidate_plans
 
 from conectsim.devices.element import Element
-from conectsim.signal import Signal
+from conectsim.signal import Signal, batch
 
 
 class Device(Element):
@@ -9,14 +9,42 @@ class Device(Element):
     def __init__(self, name=None, parent=None):
         self.parent = parent
         self.children = []
+        # Incremented whenever my state, or the state of a child, changes
+        self._version = 0
+        # The configuration information, and its version
+        self._info = None
 
         if self.parent:
             self.parent.children.append(self)
+            self.parent.touch()
 
         super(Device, self).__init__(name)
 
+    def touch(self):
+        '''Record a change of my state.'''
+        dev = self
+        while dev is not None:
+            dev._version += 1
+            dev = dev.parent
+
+    def version(self):
+        return self._version
+
+    def version_vector(self):
+        '''Versions of myself and my children, a hashable key of my state.'''
+        return (self._version,) + tuple(dev._version for dev in self.children)
+
     def config_info(self):
-        '''Return my configuration information.'''
+        '''Return my configuration information.
+
+        The information is cached until my version changes,
+        it must not be modified.
+        '''
+        if self._info is None or self._info[0] != self._version:
+            self._info = (self._version, self._config_info())
+        return self._info[1]
+
+    def _config_info(self):
         info = {}
         for dev in self.children:
             info[dev.name] = dev.config_info()
@@ -25,17 +53,21 @@ class Device(Element):
 
     def configure(self, meta):
         """Configure myself and my children."""
-        for dev in self.children:
-            key = dev.name
-            if key in meta:
-                dev.configure(meta[key])
+        # The callbacks run once, when all the children are configured
+        with batch():
+            for dev in self.children:
+                key = dev.name
+                if key in meta:
+                    dev.configure(meta[key])
 
     def set_parent(self, newparent):
         if self.parent:
             self.parent.children.remove(self)
+            self.parent.touch()
         self.parent = newparent
         if self.parent:
             self.parent.children.append(self)
+            self.parent.touch()
 
 
 class ConnectableDevice(Device, Node):
@@ -46,7 +78,7 @@ class ConnectableDevice(Device, Node):
 
 class ContainerDevice(ConnectableDevice):
 
-    def trace(self):
+    def trace_step(self):
 
         c = self.current()
         d = self
@@ -55,11 +87,27 @@ class ContainerDevice(ConnectableDevice):
             c = c.current()
 
         if isinstance(c, Source):
-            return [c]
+            return c, None
 
-        if d.previousnode:
-            return d.previousnode.trace() +  [c]
-        return [c]
+        return c, d.previousnode
+
+    def _reindex(self):
+        # The first position of each name
+        self._index = {}
+        for idx in reversed(range(self._capacity)):
+            item = self._container[idx]
+            if item:
+                if isinstance(item, basestring):
+                    self._index[item] = idx
+                else:
+                    self._index[item.name] = idx
+
+    def select(self, name):
+        try:
+            pos = self._index[name]
+        except KeyError:
+            raise ValueError('No object named %s' % name)
+        return self.move_to(pos)
 
 
 class Carrousel(ContainerDevice):
@@ -71,6 +119,8 @@ class Carrousel(ContainerDevice):
         self._pos = 0
         # object in the current position
         self._current = self._container[self._pos]
+        # position of each name
+        self._index = {}
 
         # signals
         self.changed = Signal()
@@ -88,6 +138,9 @@ class Carrousel(ContainerDevice):
 
         self._container[pos] = obj
         self._current = self._container[self._pos]
+        self._reindex()
+        self.touch()
+        invalidate_plans()
 
     def move_to(self, pos):
         if pos >= self._capacity or pos < 0:
@@ -96,24 +149,12 @@ class Carrousel(ContainerDevice):
         if pos != self._pos:
             self._pos = pos
             self._current = self._container[self._pos]
+            self.touch()
+            invalidate_plans()
             self.changed.emit(self._pos)
         self.moved.emit(self._pos)
 
-    def select(self, name):
-        # find pos of object with name
-        for idx, item in enumerate(self._container):
-            if item:
-                if isinstance(item, basestring):
-                    if item == name:
-                        return self.move_to(idx)
-                elif item.name == name:
-                    return self.move_to(idx)
-                else:
-                    pass
-        else:
-            raise ValueError('No object named %s' % name)
-
-    def config_info(self):
+    def _config_info(self):
         if self._current:
             if isinstance(self._current, basestring):
                 label = self._current
@@ -137,6 +178,8 @@ class Switch(ContainerDevice):
         self._pos = 0
         # object in the current position
         self._current = self._container[self._pos]
+        # position of each name
+        self._index = {}
 
         # signals
         self.changed = Signal()
@@ -160,6 +203,8 @@ class Switch(ContainerDevice):
         self._container[pos] = obj
 
         self._current = self._container[self._pos]
+        self._reindex()
+        self.touch()
 
 
 
@@ -169,27 +214,15 @@ class Switch(ContainerDevice):
         if pos != self._pos:
             self._pos = pos
             self._current = self._container[self._pos]
+            self.touch()
+            invalidate_plans()
             self.changed.emit(self._pos)
 
         self._current.connect(self)
         self.moved.emit(self._pos)
 
 
-    def select(self, name):
-        # find pos of object with name
-        for idx, item in enumerate(self._container):
-            if item:
-                if isinstance(item, basestring):
-                    if item == name:
-                        return self.move_to(idx)
-                elif item.name == name:
-                    return self.move_to(idx)
-                else:
-                    pass
-        else:
-            raise ValueError('No object named %s' % name)
-
-    def config_info(self):
+    def _config_info(self):
         if self._current:
             if isinstance(self._current, basestring):
                 label = self._current
@@ -42,12 +42,8 @@ class Shutter(Wheel):
     def close(self):
         self.move_to(0)
 
-    def trace(self):
+    def trace_step(self):
         if self.pos() == 0: # FIXME
-            return [self.current()]
-
-        if self.previousnode:
-            return self.previousnode.trace() +  [self.current()]
-        return [self.current()]
-
+            return self.current(), None
 
+        return self.current(), self.previousnode
@@ -1,4 +1,5 @@
 from conectsim.devices.device import Carrousel
+from conectsim.optics.basenodes import invalidate_plans
 
 
 class Wheel(Carrousel):
@@ -8,5 +9,7 @@ class Wheel(Carrousel):
     def turn(self):
         self._pos = (self._pos + 1) %  self._capacity
         self._current = self._container[self._pos]
+        self.touch()
+        invalidate_plans()
         self.changed.emit(self._pos)
 
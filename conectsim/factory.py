@@ -1,6 +1,16 @@
+import re
+from string import Formatter
 
 from astropy.io import fits
 
+# The keys of a field of a format string, i.e. 0[megara][wheel][label]
+_FIELD_KEYS = re.compile(r'\[([^\]]*)\]')
+
+def _lookup(meta, keys):
+    for key in keys:
+        meta = meta[key]
+    return meta
+
 class InsImageFactory(object):
     CARDS_P = [
         ('OBSERVAT', 'ORM', 'Name of observatory'),
@@ -9,18 +19,37 @@ class InsImageFactory(object):
         ('INSTRUME', 'INS', 'Name of the Instrument'),
         ('ORIGIN', '{0[control][name]}', 'FITS file originator'),
         ('SHUTTER', '{0[megara][shutter][label]}', 'Shutter position'),
-        ('COVER', '{0[megara][cover][label]}', 'Cover status')
+        ('COVER', '{0[megara][cover][label]}', 'Cover status'),
+        ('OBJECT', '{0[ob][object]}', 'Name of the target'),
+        ('DATE', '{0[control][date]}', 'Date of file creation'),
+        ('RUNID', '{0[control][runid]}', 'Run identifier')
     ]
 
-
-    def create(self, meta, data):
-        pheader = fits.Header(self.CARDS_P)
-        for key, value in pheader.iteritems():
+    def __init__(self):
+        # The header is compiled once, the cards with
+        # fields are updated when the fields change
+        self._template = fits.Header(self.CARDS_P)
+        self._cards = []
+        for key, value, _ in self.CARDS_P:
             if isinstance(value, basestring):
-                pheader[key] = value.format(meta)
+                fields = [tuple(_FIELD_KEYS.findall(field))
+                          for _, field, _, _ in Formatter().parse(value)
+                          if field is not None]
+                if fields:
+                    self._cards.append((key, value, fields))
+        self._values = {}
 
+    def create_header(self, meta):
+        for key, value, fields in self._cards:
+            current = [_lookup(meta, keys) for keys in fields]
+            if self._values.get(key) != current:
+                self._template[key] = value.format(meta)
+                self._values[key] = current
+        return self._template.copy()
+
+    def create(self, meta, data):
+        pheader = self.create_header(meta)
 
         hdu1 = fits.PrimaryHDU(data[0], header=pheader)
         sky_object_noise_fits = fits.HDUList([hdu1])
         return sky_object_noise_fits
-
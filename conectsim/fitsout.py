@@ -0,0 +1,84 @@
+
+'''Streaming of detector frames into FITS files.'''
+
+import numpy as np
+from astropy.io import fits
+
+# Size of the FITS blocks
+BLOCK_SIZE = 2880
+# Zero point of the unsigned 16 bit values stored as int16
+BZERO = 32768
+
+
+def _padding(size):
+    return (BLOCK_SIZE - size % BLOCK_SIZE) % BLOCK_SIZE
+
+
+def int16_header(header, shape):
+    '''Primary header of a uint16 frame stored as int16.'''
+    hdr = fits.Header([('SIMPLE', True, 'conforms to FITS standard'),
+                       ('BITPIX', 16, 'array data type'),
+                       ('NAXIS', 2, 'number of array dimensions'),
+                       ('NAXIS1', shape[1]),
+                       ('NAXIS2', shape[0]),
+                       ('EXTEND', True)])
+    hdr.extend(header)
+    hdr['BSCALE'] = 1
+    hdr['BZERO'] = BZERO
+    return hdr
+
+
+def write_int16(filename, header, data, memmap=False, block_rows=256):
+    '''Write a uint16 frame into a FITS file, stored as int16.
+
+    The header is written once. The data is converted into the
+    file in blocks of rows, or directly into the file mapped
+    in memory if memmap is True, without copies of the frame.
+    '''
+    hstr = int16_header(header, data.shape).tostring()
+    nbytes = 2 * data.size
+    zero = np.uint16(BZERO)
+    with open(filename, 'wb') as fd:
+        fd.write(hstr)
+        if memmap:
+            # Preallocate the data
+            fd.truncate(len(hstr) + nbytes + _padding(nbytes))
+        else:
+            buf = np.empty((block_rows, data.shape[1]), dtype='>i2')
+            for start in range(0, data.shape[0], block_rows):
+                rows = data[start:start + block_rows]
+                chunk = buf[:len(rows)]
+                # uint16 - BZERO wraps around into the int16 value
+                np.subtract(rows, zero, out=chunk, casting='unsafe')
+                chunk.tofile(fd)
+            fd.write(b'\0' * _padding(nbytes))
+
+    if memmap:
+        mapped = np.memmap(filename, dtype='>i2', mode='r+',
+                           offset=len(hstr), shape=data.shape)
+        np.subtract(data, zero, out=mapped, casting='unsafe')
+        mapped.flush()
+        del mapped
+
+
+def write_compressed(filename, header, data, compression='RICE_1'):
+    '''Write a frame into a tile compressed FITS file.'''
+    # The header of the compressed image requires the image keywords
+    header = fits.ImageHDU(data, header=header).header
+    hdul = fits.HDUList([fits.PrimaryHDU(),
+                         fits.CompImageHDU(data, header=header,
+                                           compression_type=compression)])
+    hdul.writeto(filename, overwrite=True)
+
+
+def create_container(filename, header=None):
+    '''Create a FITS file holding frames in extensions.'''
+    fits.PrimaryHDU(header=header).writeto(filename, overwrite=True)
+
+
+def append_frame(filename, header, data, name):
+    '''Append a frame to a container, as an image extension.'''
+    header = header.copy()
+    header['EXTNAME'] = name
+    # The container is only written sequentially
+    fits.append(filename, data, header, verify=False)
@@ -3,23 +3,27 @@ import math
 
 import numpy as np
 
-from scipy import interpolate
+from scipy import sparse
 
 from scipy.ndimage.filters import convolve1d as image_convolve
 
 from conectsim.devices.pseudoslit import Slit
 from .simulator_utils import create_interpolator
-from .simulator_utils import apply_distortion
 from .megara_object import MegaraObject
 from .astrophysics_unit import ergscm2aaarcsec2photonsm2nmarcsec2
 from conectsim.devices.das import DataAdquisitionSystem
 from conectsim.devices.cover import C_Cover
 from conectsim.devices.device import Device
+from conectsim.signal import Signal, batch
 from .factory import InsImageFactory
+from .cache import Cache, freeze
+from .targets import layout_flux
 from conectsim.devices.shutter import Shutter
-from conectsim.optics.optelement import OpticalElement
+from conectsim.optics.optelement import OpticalElement, path_transmission
 from conectsim.devices.calibration import CalibrationUnitSwitch, LampCarrousel
 from conectsim.optics.optelement import Stop, Open
+from conectsim.optics.distortion import DistortionModel
+from conectsim.optics.spectralcube import grid_key
 
 _logger = logging.getLogger('connectsim')
 
@@ -79,21 +83,7 @@ class C_Device(Device):
         self.layout = self.pslit.current()
 
         # Callbacks get called on predefined events on the devices
-        # A callback to maintain self.vph updated
-    	# whenever the wheel is moved
-        def update_current_vph(_):
-            self.vph = self.wheel.current()
-
-        self.wheel.changed.connect(update_current_vph)
-
-        # Operations whenever the fiber bundle feed into
-    	# the pseudo slit changes
-        def update_current_bundle(_):
-            self.layout = self.pslit.current()
-            if self.layout is not None:
-                self.foc_plane.set_layout(self.layout)
-
-        self.pslit.changed.connect(update_current_bundle)
+        self._connect_signals()
 
         # Set an "order sorting filter" with the red vphs
         
@@ -105,8 +95,6 @@ class C_Device(Device):
         #     
         #self.wheel.moved.connect(insert_order_sorting_filter)
 
-        self.transmission_interp = None
-        
         # Light path
         self.telescope.connect(openentry)
 
@@ -117,9 +105,30 @@ class C_Device(Device):
         self.shutter.connect(self.optics)
         self.optics.connect(self.wheel)
         self.wheel.connect(detector)
-        
-    def config_info(self):
-        '''Return the configuration information of MEGARA.'''
+
+    def _connect_signals(self):
+        '''Connect the callbacks to the signals of the devices.'''
+        # A callback to maintain self.vph updated
+        # whenever the wheel is moved
+        self.wheel.changed.connect(self._update_current_vph)
+        # Operations whenever the fiber bundle feed into
+        # the pseudo slit changes
+        self.pslit.changed.connect(self._update_current_bundle)
+
+    def _update_current_vph(self, _):
+        self.vph = self.wheel.current()
+
+    def _update_current_bundle(self, _):
+        self.layout = self.pslit.current()
+        if self.layout is not None:
+            self.foc_plane.set_layout(self.layout)
+
+    def __setstate__(self, state):
+        # The signals are unpickled without callbacks
+        self.__dict__.update(state)
+        self._connect_signals()
+
+    def _config_info(self):
         info = {}
         for dev in self.children:
             info[dev.name] = dev.config_info()
@@ -145,18 +154,22 @@ class C_Device(Device):
         hdul = self.image_factory.create(meta, finaldata)
         return hdul
 
+    def header(self, meta):
+        return self.image_factory.create_header(meta)
+
     def configure(self, profile):
         '''Configure MEGARA.'''
         _logger.debug('Configure MEGARA with profile %s', profile['description'])
-        self.shutter.configure(profile['shutter'])
-        self._set_cover_state(profile['cover'])
-        self._change_layout(profile['bundle'])
-        self._change_vph(profile['vph'])
-        self._change_cu(1, 1)
+        # The callbacks of the devices run once, after all the moves
+        with batch():
+            self.shutter.configure(profile['shutter'])
+            self._set_cover_state(profile['cover'])
+            self._change_layout(profile['bundle'])
+            self._change_vph(profile['vph'])
+            self._change_cu(1, 1)
+            if 'readout' in profile:
+                self.das.configure(profile['readout'])
         _logger.info('Path of the light %s', self.detector.trace())
-        self.cuselector.print_from_the_begining()
-        import sys
-        sys.exit()
 
 class Connecttt(C_Device):
     ''' Class that handles all MEGARA components and operations. ''' 
@@ -164,14 +177,67 @@ class Connecttt(C_Device):
         # Not all here is a Device, actually
         super(Connecttt, self).__init__(fibers, optics, wheel, detector, telescope, pslit, focal_plane)
 
-    
+        # Geometry of the fibers and projection of the spectra over
+        # the detector, they depend on the VPH, the fiber bundle and the cover
+        self._geometry = None
+        self._trace_bounds = None
+        self._trace_operator = None
+
+        # Distortion of the spectra, for each VPH
+        self._distortion_models = Cache()
+
+        # Path of the light, it changes whenever a device moves
+        self._light_path = None
+        # The quantum efficiency of the detector, as an optical element
+        self._qe = None
+        # Total transmission, for each optical path and wavelength grid
+        self._transmission_cache = Cache(maxsize=8)
+
+        # The configuration key, and the versions of the devices
+        self._config_key = None
+
+        # Noiseless images, in photons per second
+        self._rate_cache = Cache(maxsize=4)
+
+        # Intermediate arrays of the pipeline, reused between exposures
+        self._buffers = {}
+        # The resampler of the last wavelength distortion, and the
+        # conversion to photons in the pixels of the detector
+        self._resampler = None
+        self._photon_factor = None
+        # If True, the stages after the transmission overwrite their
+        # input instead of writing in a preallocated buffer
+        self.inplace = False
+        # If True, the resampling to the detector columns conserves the flux
+        self.conserve_flux = False
+
+    def _connect_signals(self):
+        super(Connecttt, self)._connect_signals()
+        self.wheel.changed.connect(self._invalidate_traces)
+        self.pslit.changed.connect(self._invalidate_traces)
+        self.cover.changed_left.connect(self._invalidate_traces)
+        self.cover.changed_right.connect(self._invalidate_traces)
+        for signal in self._changed_signals():
+            signal.connect(self._invalidate_light_path)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The buffers and the noiseless images are not worth pickling
+        state['_buffers'] = {}
+        state['_photon_factor'] = None
+        state['_rate_cache'] = Cache(maxsize=self._rate_cache.maxsize)
+        state['_transmission_cache'] = Cache(maxsize=self._transmission_cache.maxsize)
+        return state
+
     def set_targets(self,target_container):
         self.foc_plane.set_target_list(target_container)
+        self._rate_cache.clear()
         #if self.foc_plane.observing_conditions is not None:
         #    self.foc_plane.target_list.set_seeing(self.foc_plane.observing_conditions.seeing)
         
     def set_observing_conditions(self, obs_conditions):
         self.foc_plane.set_observing_conditions(obs_conditions)
+        self._rate_cache.clear()
         
                        
     def create_wavelength_distortion_interpolator(self):
@@ -180,44 +246,85 @@ class Connecttt(C_Device):
     def create_spatial_distortion_interpolator(self):
         self.vph.create_spatial_distortion_interpolator_ins(self.detector)
         
-    def create_traces(self,trace,min_y_coor):
-        ''' Computes the shape of the different spectra according to their position on the detector. '''
-        fiber_positions_on_detector = self.layout.get_fiber_positions_on_detector(self.cover)
-        fiber_separation = fiber_positions_on_detector[1] - fiber_positions_on_detector[0]
-        logging.debug('VPH: Creating traces...')
-        
-        # Create an array to hold the spectra adding space for the projection
-        max_y_coor = np.ceil(trace.max(axis = 1))
-        
-        def create_single_trace(i):
-            ''' Function that creates a trace given the position over the detector.
-                The function is used in the list comprehension below to increase speed x2'''
-            spectra_y_dim = max_y_coor[i] - min_y_coor[i] + fiber_separation
-            spectra=np.zeros([spectra_y_dim,self.detector.size_x])
-            trace[i]=trace[i]-min_y_coor[i]-1 # Size of the projection=7
-            # Introduce the trace in spectra array
-            floor_trace=np.floor(trace[i]).tolist()
-            ceil_trace=np.ceil(trace[i]).tolist()
-            pixel_frac=trace[i] % 1.0 # FIXME: what is this operation?
-            spectra[floor_trace, range(spectra.shape[1])] = 1 - pixel_frac
-            spectra[ceil_trace, range(spectra.shape[1])] = pixel_frac 
-
-            return spectra
-
-        traces = [create_single_trace(i) for i in range(len(fiber_positions_on_detector))]
-        logging.debug('VPH: Traces created.')
-	return traces
-        
-    def run(self, exptime):
-        ''' Take image of exptime seconds of current focal plane.'''
-        
-        _logger.info('Taking image. Exptime: %i seconds',exptime)
-                       
-        self.vph.create_distortion_interpolators(self.detector, self.slit)
+    def create_trace_operator(self, trace):
+        ''' Computes the projection of the spectra according to their position on the detector.
+
+            The operator is a sparse matrix mapping the raveled (nfibers, size_x)
+            spectra into the raveled (size_y, size_x) detector image. In each
+            column, a fiber contributes to the two rows bracketing its trace.
+        '''
+        logging.debug('VPH: Creating trace operator...')
+        nfibers, size_x = trace.shape
+        size_y = self.detector.size_y
+        # The trace is shifted one pixel down
+        floor_trace = np.floor(trace) - 1
+        pixel_frac = trace % 1.0
+
+        columns = np.arange(nfibers * size_x)
+        pixel_x = columns % size_x
+        rows = np.concatenate([floor_trace.ravel(), floor_trace.ravel() + 1]).astype('int')
+        weights = np.concatenate([1 - pixel_frac.ravel(), pixel_frac.ravel()])
+        columns = np.concatenate([columns, columns])
+        pixel_x = np.concatenate([pixel_x, pixel_x])
+
+        # Drop the contributions falling outside the detector
+        valid = (rows >= 0) & (rows < size_y) & (weights > 0)
+        operator = sparse.coo_matrix((weights[valid],
+                                      (rows[valid] * size_x + pixel_x[valid], columns[valid])),
+                                     shape=(size_y * size_x, nfibers * size_x))
+        logging.debug('VPH: Trace operator created.')
+        return operator.tocsr()
+
+    def cache_info(self):
+        ''' Hits, misses and size of the caches. '''
+        return {'rate': self._rate_cache.info(),
+                'transmission': self.transmission_cache_info(),
+                'distortion': self._distortion_models.info()}
+
+    def distortion_model(self):
+        ''' The distortion model of the current VPH, built once for each VPH. '''
+        return self._distortion_models.get(self.vph,
+                    lambda: DistortionModel(self.vph, self.detector, self.slit))
+
+    def fibers_key(self):
+        ''' Identify the fibers illuminated on the detector. '''
+        return self.layout.name, self.cover.pos()
+
+    def geometry(self):
+        ''' Geometry of the fibers of the current bundle illuminated with the current cover. '''
+        if self._geometry is None:
+            self._geometry = self.layout.fiber_geometry(self.cover)
+        return self._geometry
+
+    def trace_bounds(self):
+        ''' Lower and upper rows of the traces of the illuminated fibers on the detector. '''
+        if self._trace_bounds is None:
+            geometry = self.geometry()
+            trace = self.distortion_model().trace_table(self.fibers_key(), geometry.positions)
+            self._trace_bounds = geometry.trace_bounds(trace)
+        return self._trace_bounds
+
+    def _invalidate_traces(self, _):
+        self._geometry = None
+        self._trace_bounds = None
+        self._trace_operator = None
+
+    def config_key(self):
+        ''' Hashable description of the current configuration of the instrument. '''
+        # The DAS metadata changes in every exposure
+        versions = tuple(dev.version() for dev in self.children if dev is not self.das)
+        if self._config_key is None or self._config_key[0] != versions:
+            key = freeze(dict((dev.name, dev.config_info())
+                              for dev in self.children if dev is not self.das))
+            self._config_key = (versions, key)
+        return self._config_key[1]
+
+    def compute_rate_image(self):
+        ''' Compute the noiseless image of the current focal plane, in photons per second.'''
+        self.distortion_model().build()
         self.foc_plane.set_vph(self.vph)
         
-        self.foc_plane.compute_layout_flux(self.cover)
-        input = MegaraObject(self.foc_plane.focal_plane_flux,
+        input = MegaraObject(self.layout_flux(),
                              self.foc_plane.target_list.spec_db.wl_sampled,
                              self.layout.name,
                              self.vph.resolution_interpolator(self.foc_plane.target_list.spec_db.wl_sampled[-1]
@@ -229,23 +336,91 @@ class Connecttt(C_Device):
         photon_distorted_input = self.convert_to_photons(distorted_input)
         spatial_distorted_detector_image = self.apply_spatial_distortion(photon_distorted_input)
         detector_image = self.project_spatial_profile(spatial_distorted_detector_image)
-        self.detector.set_input(detector_image)
         logging.debug('MEGARA: Spatial profile projected.')
+        return detector_image
+
+    def layout_flux(self):
+        ''' Flux of the targets in the illuminated fibers of the current bundle.
+
+            If the target list gives the gaussian profiles of the targets,
+            gaussians(seeing) returning their centers, sigmas and spectra,
+            the flux of each target is only evaluated in the fibers near it,
+            see conectsim.targets. Otherwise the flux is computed by the focal plane.
+        '''
+        targets = self.foc_plane.target_list
+        if not hasattr(targets, 'gaussians') or self.layout.fiber_positions is None:
+            self.foc_plane.compute_layout_flux(self.cover)
+            return self.foc_plane.focal_plane_flux
+        # The fibers are hexagonal
+        area = 0.5 * 3 * math.sqrt(3) * (0.5 * self.layout.size) ** 2
+        flux = layout_flux(self.layout, targets, self.foc_plane.observing_conditions.seeing, area)
+        return flux[self.geometry().mask]
+
+    def rate_image(self):
+        ''' Noiseless image of the current focal plane, in photons per second.
+
+            The image is cached for each configuration of the instrument,
+            the cache is cleared when the targets or the observing conditions change.
+        '''
+        return self._rate_cache.get(self.config_key(), self.compute_rate_image)
+
+    def illumination(self):
+        ''' Image illuminating the detector, in photons per second, or None if the light is blocked. '''
+        if self.light_blocked():
+            # Bias or dark, only the detector is simulated
+            logging.debug('MEGARA: Light path blocked.')
+            return None
+        return self.rate_image()
+
+    def run(self, exptime):
+        ''' Take image of exptime seconds of current focal plane.'''
+        
+        _logger.info('Taking image. Exptime: %i seconds',exptime)
+
+        self.detector.set_input(self.illumination())
         
         logging.debug('MEGARA: Exposing detector...')                
-        #self.detector.expose(exptime)
-        data = self.das.run(exptime)
+        # The reads are produced one by one
+        for data in self.das.run(exptime):
+            # No post-processing
+            yield [data]
         logging.debug('MEGARA: Detector exposed.')        
-        # No post-processing
         logging.info('MEGARA:Image successfully taken.')
-        yield list(data)
         
 
+    def _buffer(self, name, shape):
+        ''' Return a preallocated array, reused between exposures. '''
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape)
+            self._buffers[name] = buf
+        return buf
+
+    def _stage_output(self, name, input):
+        ''' Return the object where a pipeline stage writes its result. '''
+        if self.inplace:
+            return input
+        out = self._buffer(name, input.data.shape)
+        return MegaraObject(out, input.wavelength, input.layout, input.resolution)
+
     def apply_transmission(self,input):
         logging.debug('MEGARA:Applying transmission...')
-        if self.transmission_interp is None:
-            self.create_total_transmission_interp()
-        return MegaraObject(np.array([input.data[i,:]*self.transmission_interp(input.wavelength) for i in range(input.data.shape[0])]),input.wavelength,input.layout,input.resolution)
+        # The input is the flux cached by the focal plane, it is
+        # written in a buffer even if inplace is set, so that it is never modified
+        output = MegaraObject(self._buffer('transmission', input.data.shape),
+                              input.wavelength, input.layout, input.resolution)
+        np.multiply(input.data, self.transmission(input.wavelength), out=output.data)
+        return output
+
+    def transmission(self, wavelength):
+        ''' Total transmission of the current optical path, sampled in wavelength.
+
+            The transmission is cached for each optical path, a spectrum
+            is passed once through the elements of the path.
+        '''
+        path = self.optical_path()
+        return self._transmission_cache.get((path, grid_key(wavelength)),
+                                            lambda: path_transmission(path, wavelength))
         
     def degrade_resolution(self,input):
         logging.debug('MEGARA:Degrading resolution...') 
@@ -254,63 +429,103 @@ class Connecttt(C_Device):
     
     def apply_wavelength_distortion(self,input):
         logging.debug('MEGARA:Applying wavelength distortion...')
-        if self.vph.wavelength_distortion_interpolator is None:
-            logging.debug('VPH:Creating wavelength distortion interpolator...')
-            self.create_wavelength_distortion_interpolator()
-            logging.debug('VPH:Wavelength distortion interpolator finished.')
-        fiber_pos_det = self.layout.get_fiber_positions_on_detector(self.cover)
-        input_detector_resampled = np.zeros((len(fiber_pos_det), self.detector.size_x))
-        wavelength_detector_resampled = np.zeros_like(input_detector_resampled)
-        self.dispersion = np.zeros_like(input_detector_resampled)
-        
+        fiber_pos_det = self.geometry().positions
+        resampler = self.distortion_model().resampler(self.fibers_key(), fiber_pos_det,
+                                                      input.wavelength, self.conserve_flux)
         logging.debug('VPH: Distorting wavelengths...')        
-        apply_distortion(fiber_pos_det, input.data, input.wavelength, self.vph.wavelength_distortion_interpolator, input_detector_resampled, wavelength_detector_resampled)
+        input_detector_resampled = resampler(input.data, out=self._buffer('resampled', resampler.shape))
         logging.debug('VPH: Distorting wavelengths finished.')
-        self.dispersion[:,:-1] = np.diff(wavelength_detector_resampled) / 10.0 # * aa2nm
-        self.dispersion[:,-1] = self.dispersion[:,-2]
-        return MegaraObject(input_detector_resampled,wavelength_detector_resampled,input.layout,input.resolution)
+        self.dispersion = resampler.dispersion
+        self._resampler = resampler
+        return MegaraObject(input_detector_resampled, resampler.wavelength, input.layout, input.resolution)
     
+    def photon_factor(self, resampler):
+        ''' Conversion of the flux to photons per second in each pixel.
+
+            The factor is computed once for each resampler.
+        '''
+        tel_area = math.pi * (self.telescope.diameter / 2.0 ) ** 2.0
+        cached = self._photon_factor
+        if cached is not None and cached[0] is resampler and cached[1] == tel_area:
+            return cached[2]
+        # The conversion of units is linear in the flux
+        factor = ergscm2aaarcsec2photonsm2nmarcsec2(resampler.wavelength,
+                                                    np.ones(resampler.shape))
+        factor = factor * resampler.dispersion
+        factor *= tel_area
+        factor.setflags(write=False)
+        self._photon_factor = (resampler, tel_area, factor)
+        return factor
+
     def convert_to_photons(self, input):
         logging.debug('MEGARA:Converting input flux to photons...')
         spaxel_aperture = (0.5 * 3 * math.sqrt(3) * (0.5 * self.layout.size) ** 2)
-        tel_area = math.pi * (self.telescope.diameter / 2.0 ) ** 2.0
-        throughput = self.dispersion * tel_area
-        for i in range(len(self.layout.get_fiber_positions_on_detector(self.cover))):
-#        for i,_ in enumerate(self.layout.get_fiber_positions_on_detector()):
-            input.data[i,:]=ergscm2aaarcsec2photonsm2nmarcsec2(input.wavelength[i,:], input.data[i,:]) 
-        return MegaraObject(input.data * throughput, input.wavelength, input.layout, input.resolution)
+        output = self._stage_output('photons', input)
+        np.multiply(input.data, self.photon_factor(self._resampler), out=output.data)
+        return output
     
     def apply_spatial_distortion(self, input):
         logging.debug('MEGARA:Applying spatial distortion...')
 
-        detector_spatial_distorted=np.zeros([self.detector.size_y,self.detector.size_x])
-#        detector_spatial_distorted += 100
-        fiber_positions_on_detector = self.layout.get_fiber_positions_on_detector(self.cover)
+        if self._trace_operator is None:
+            fiber_positions_on_detector = self.geometry().positions
+            trace = self.distortion_model().trace_table(self.fibers_key(), fiber_positions_on_detector)
+            self._trace_operator = self.create_trace_operator(trace)
 
-        fiber_separation = np.diff(self.vph.spatial_distortion_interpolator(0, fiber_positions_on_detector))
-        fiber_separation = np.append(fiber_separation, fiber_separation[-1])
-        fiber_separation = np.ceil(fiber_separation)
-        
-        
-        fiber_positions_on_detector.shape = (fiber_positions_on_detector.shape[0],1)
-        trace = self.vph.spatial_distortion_interpolator(range(self.detector.size_x),fiber_positions_on_detector)
-        min_y_coor=np.floor(trace.min(axis=1))-fiber_separation
-        
-        #if self.used_traces[self.vph.vph_name] is None:
-        traces = self.create_traces(trace, min_y_coor)
-            
-        for i,_ in enumerate(fiber_positions_on_detector[:,0]):
-            detector_spatial_distorted[min_y_coor[i]:min_y_coor[i]+traces[i].shape[0]] = detector_spatial_distorted[min_y_coor[i]:min_y_coor[i]+traces[i].shape[0]] + traces[i]*input.data[i,:]
-        
+        detector_spatial_distorted = self._trace_operator.dot(input.data.ravel())
+        detector_spatial_distorted.shape = (self.detector.size_y, self.detector.size_x)
         return detector_spatial_distorted
     
     def project_spatial_profile(self,input):
         logging.debug('MEGARA:Projecting spatial profile...')
         return image_convolve(input, self.layout.projection_kernel, axis=0, mode='constant', cval=0.0)
-            
-    def create_total_transmission_interp(self):
-        wave = np.linspace(3600.00, 9800.00, 6200)
-        trans = self.optics.transmission_interp(wave) * self.fibers.transmission_interp(wave) * self.detector.transmission_interp(wave) * self.vph.transmission_interp(wave) * self.telescope.transmission_interp(wave)
-        trans[trans<0] = 0.0
-        interp = interpolate.interp1d(wave, trans, 'linear', bounds_error=False, fill_value=0.)
-        self.transmission_interp = interp
+
+    def _invalidate_light_path(self, _):
+        self._light_path = None
+
+    def _changed_signals(self):
+        ''' The changed signals of the devices of the instrument. '''
+        pending = list(self.children)
+        while pending:
+            dev = pending.pop()
+            pending.extend(dev.children)
+            signal = getattr(dev, 'changed', None)
+            if isinstance(signal, Signal):
+                yield signal
+
+    def light_path(self):
+        ''' The elements in the path of the light, from the entrance to the detector. '''
+        if self._light_path is None:
+            self._light_path = tuple(self.detector.trace())
+        return self._light_path
+
+    def light_blocked(self):
+        ''' True if no light reaches the detector.
+
+            The path starts in a Stop if the shutter is closed
+            or a Stop is selected in a device.
+        '''
+        return isinstance(self.light_path()[0], Stop)
+
+    def detector_qe(self):
+        ''' The quantum efficiency of the detector, as an optical element. '''
+        interp = self.detector.transmission_interp
+        if self._qe is None or self._qe.transmission_interp is not interp:
+            self._qe = OpticalElement(interp, name='qe')
+        return self._qe
+
+    def optical_path(self):
+        ''' The optical elements in the current light path, and the detector.
+
+            The path starts with the elements in front of the telescope, the atmosphere.
+        '''
+        # The telescope and the fibers are not in the traced path
+        front = tuple(self.telescope.trace())
+        path = [element for element in front + (self.fibers,) + self.light_path()
+                if isinstance(element, OpticalElement)]
+        path.append(self.detector_qe())
+        return tuple(path)
+
+    def transmission_cache_info(self):
+        ''' Hits, misses and size of the total transmissions of the optical paths. '''
+        return self._transmission_cache.info()
@@ -1,10 +1,26 @@
 
+# The nodes keep their compiled plans, (trace, chain), with the
+# generation of the graph they belong to. A new generation starts
+# whenever the graph changes
+_generation = [object()]
+
+
+def invalidate_plans():
+    '''Discard the compiled plans, the graph has changed.'''
+    # The plans of unpickled nodes are also discarded,
+    # their generation is never the current object
+    _generation[0] = object()
+
+
 def connect(node1, node2):
     node1.connect(node2)
 
 
 class BaseNode(object):
     '''Something that can be connected to something else.'''
+    # The compiled plan, (generation, plan)
+    _compiled = None
+
     def __init__(self, nin, nout, id=None):
         self.nin = nin
         self.nout = nout
@@ -18,6 +34,7 @@ class BaseNode(object):
 
         self.nextnode = node.head()
         self.nextnode.set_tail(self)
+        invalidate_plans()
 
     def head(self):
         return self
@@ -43,23 +60,53 @@ class BaseNode(object):
     def current(self):
         return self
 
-    def trace(self):
-        if self.previousnode:
-            return self.previousnode.trace() +  [self.current()]
-        return [self.current()]
+    def trace_step(self):
+        '''Return the active element of the node and the previous node.
 
-    def visit(self):
+        The previous node is None if the path of the light starts here.
+        '''
+        return self.current(), self.previousnode
+
+    def _plan(self):
+        compiled = self._compiled
+        if compiled is not None and compiled[0] is _generation[0]:
+            return compiled[1]
+        # The path of the light ending here, walked backwards
+        path = []
+        node = self
+        while node is not None:
+            element, node = node.trace_step()
+            path.append(element)
+        path.reverse()
+
+        # The chain of nodes from the first source
         node = self
         while node.previousnode is not None:
             node = node.previousnode
-
+        chain = []
         if isinstance(node, Source):
-            token = node.create()
-            if node.nextnode:
-                final = node.nextnode.receive(token)
-        else:
-            final = None
+            chain.append(node)
+            node = node.nextnode
+            while node is not None:
+                chain.append(node)
+                node = node.nextnode
+
+        plan = tuple(path), tuple(chain)
+        self._compiled = _generation[0], plan
+        return plan
 
+    def trace(self):
+        return list(self._plan()[0])
+
+    def visit(self):
+        chain = self._plan()[1]
+        if not chain:
+            return None
+
+        token = chain[0].create()
+        final = None
+        for node in chain[1:]:
+            token = final = node.transform(token)
         return final
 
 
@@ -81,8 +128,8 @@ class Source(BaseNode):
         if self.nextnode is not None:
             self.nextnode.receive(newdata)
 
-    def trace(self):
-        return [self.current()]
+    def trace_step(self):
+        return self.current(), None
 
 
 class Sink(BaseNode):
@@ -0,0 +1,160 @@
+
+'''Distortion of the spectra over the detector.'''
+
+import numpy as np
+
+
+class DistortionModel(object):
+    '''Distortion of the spectra produced by a VPH over the detector.
+
+    The distortion interpolators of the VPH are built once, on first use.
+    Their values in each column of the detector are tabulated for
+    each set of fiber positions.
+    '''
+    def __init__(self, vph, detector, slit):
+        self.vph = vph
+        self.detector = detector
+        self.slit = slit
+        self._built = False
+        self._wavelength = {}
+        self._trace = {}
+        self._resamplers = {}
+
+    def build(self):
+        '''Build the distortion interpolators of the VPH.'''
+        if not self._built:
+            self.vph.create_distortion_interpolators(self.detector, self.slit)
+            if self.vph.wavelength_distortion_interpolator is None:
+                self.vph.create_distortion_interpolator_ins(self.detector)
+            self._built = True
+
+    def _tabulate(self, name, fiber_positions):
+        self.build()
+        interpolator = getattr(self.vph, name)
+        columns = np.arange(self.detector.size_x)
+        table = interpolator(columns, np.reshape(fiber_positions, (-1, 1)))
+        table.setflags(write=False)
+        return table
+
+    def wavelength_table(self, key, fiber_positions):
+        '''Wavelength of each fiber in each column of the detector.
+
+        Returns a read-only (nfibers, size_x) array. The table is
+        computed once for each key identifying the fiber positions.
+        '''
+        try:
+            return self._wavelength[key]
+        except KeyError:
+            table = self._tabulate('wavelength_distortion_interpolator',
+                                   fiber_positions)
+            self._wavelength[key] = table
+            return table
+
+    def trace_table(self, key, fiber_positions):
+        '''Row of the trace centre of each fiber in each column of the detector.
+
+        Returns a read-only (nfibers, size_x) array. The table is
+        computed once for each key identifying the fiber positions.
+        '''
+        try:
+            return self._trace[key]
+        except KeyError:
+            table = self._tabulate('spatial_distortion_interpolator',
+                                   fiber_positions)
+            self._trace[key] = table
+            return table
+
+    def resampler(self, key, fiber_positions, wavelength, conserve_flux=False):
+        '''Resampler from the wavelength grid to the detector columns.
+
+        The resampler is computed once for each key identifying
+        the fiber positions, while the wavelength grid does not change.
+        '''
+        rkey = key, conserve_flux
+        resampler = self._resamplers.get(rkey)
+        if resampler is None or not np.array_equal(resampler.grid, wavelength):
+            table = self.wavelength_table(key, fiber_positions)
+            resampler = Resampler(wavelength, table, conserve_flux=conserve_flux)
+            self._resamplers[rkey] = resampler
+        return resampler
+
+
+def _linear_weights(grid, points):
+    '''Indices in the raveled spectra and weights of a linear interpolation.'''
+    size = len(grid)
+    index = np.searchsorted(grid, points)
+    np.clip(index, 1, size - 1, out=index)
+    lower = grid[index - 1]
+    upper = grid[index]
+    weight = (points - lower) / (upper - lower)
+    offset = size * np.arange(points.shape[0])[:, np.newaxis]
+    index += offset
+    return index - 1, index, 1 - weight, weight
+
+
+class Resampler(object):
+    '''Resample spectra from a common wavelength grid to the detector columns.
+
+    The interpolation indices and weights are computed once, and then
+    applied to all the fibers at the same time. If conserve_flux is True,
+    the resampled value is the mean of the spectrum over each pixel,
+    instead of its value in the centre of the pixel.
+    '''
+    def __init__(self, grid, wavelength, conserve_flux=False):
+        self.grid = grid
+        self.wavelength = wavelength
+        self.shape = wavelength.shape
+        self.conserve_flux = conserve_flux
+
+        width = np.diff(wavelength)
+        # Dispersion, in nm per pixel
+        self.dispersion = np.empty(self.shape)
+        self.dispersion[:, :-1] = width / 10.0 # * aa2nm
+        self.dispersion[:, -1] = self.dispersion[:, -2]
+        self.dispersion.setflags(write=False)
+
+        if conserve_flux:
+            # Edges of the pixels
+            points = np.empty((self.shape[0], self.shape[1] + 1))
+            points[:, 1:-1] = wavelength[:, :-1] + 0.5 * width
+            points[:, 0] = wavelength[:, 0] - 0.5 * width[:, 0]
+            points[:, -1] = wavelength[:, -1] + 0.5 * width[:, -1]
+            self._width = np.diff(points)
+            np.clip(points, grid[0], grid[-1], out=points)
+        else:
+            points = wavelength
+
+        self._lower, self._upper, self._wlower, self._wupper = _linear_weights(grid, points)
+
+        if not conserve_flux:
+            # No flux outside the grid
+            outside = (points < grid[0]) | (points > grid[-1])
+            self._wlower[outside] = 0.0
+            self._wupper[outside] = 0.0
+
+    def _interpolate(self, data, out):
+        np.take(data, self._lower, out=out)
+        out *= self._wlower
+        upper = np.take(data, self._upper)
+        upper *= self._wupper
+        out += upper
+        return out
+
+    def __call__(self, data, out=None):
+        '''Resample data, a (nfibers, len(grid)) array.'''
+        if out is None:
+            out = np.empty(self.shape)
+
+        if self.conserve_flux:
+            # Integral of the spectra up to each point of the grid
+            cumulative = np.empty_like(data)
+            cumulative[:, 0] = 0.0
+            step = data[:, 1:] + data[:, :-1]
+            step *= 0.5 * np.diff(self.grid)
+            np.cumsum(step, axis=1, out=cumulative[:, 1:])
+            edges = self._interpolate(cumulative, np.empty(self._lower.shape))
+            np.subtract(edges[:, 1:], edges[:, :-1], out=out)
+            out /= self._width
+        else:
+            self._interpolate(np.ascontiguousarray(data), out)
+        return out
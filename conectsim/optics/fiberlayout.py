@@ -1,9 +1,174 @@
 
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
 from conectsim.optics.optelement import OpticalElement
 
+# Fibers further than NSIGMA sigmas from a target receive no flux
+NSIGMA = 5.0
+
+class FiberGeometry(namedtuple('FiberGeometry', ['positions', 'separation', 'mask'])):
+    '''Geometry of the fibers illuminated with a cover position.
+
+    positions and separation are the positions of the illuminated
+    fibers over the pseudo-slit and the separation to the next one.
+    mask selects the illuminated fibers of the bundle.
+    '''
+    __slots__ = ()
+
+    def trace_bounds(self, trace):
+        '''Lower and upper rows of the traces of the fibers on the detector.
+
+        trace is the row of the trace centre of each fiber in each
+        column of the detector, (nfibers, size_x). In each column, a
+        trace extends to the midpoints to the traces of its neighbours,
+        the first and last ones as far as to their only neighbour.
+        Returns two (nfibers,) arrays.
+        '''
+        trace = np.asarray(trace, dtype='float')
+        edges = np.empty((trace.shape[0] + 1, trace.shape[1]))
+        if len(trace) > 1:
+            edges[1:-1] = 0.5 * (trace[1:] + trace[:-1])
+            edges[0] = 2 * trace[0] - edges[1]
+            edges[-1] = 2 * trace[-1] - edges[-2]
+        else:
+            edges[:] = trace
+        # The traces may run in either direction over the detector
+        lower = np.minimum(edges[:-1], edges[1:]).min(axis=1)
+        upper = np.maximum(edges[:-1], edges[1:]).max(axis=1)
+        return lower, upper
+
+
 class FiberBundle(OpticalElement):
-    def __init__(self, name):
-       super(FiberBundle, self).__init__(transmission=1.0, name=name)
+    def __init__(self, name, fiber_positions=None, slit_positions=None):
+        super(FiberBundle, self).__init__(transmission=1.0, name=name)
+        # Positions of the fibers in the focal plane
+        self.fiber_positions = fiber_positions
+        # Positions of the fibers in the pseudo-slit
+        self.slit_positions = slit_positions
+        self._geometry = {}
+        # Index of the positions of the fibers in the focal plane
+        self._tree = None
+        # The last weight matrix computed, and its key
+        self._weights = None
+
+    @classmethod
+    def load(cls, name, filename):
+        '''Create the bundle described in a table of fibers.
+
+        Each row of the table is a fiber, with its x and y in the
+        focal plane and its position in the pseudo-slit.
+        '''
+        table = np.loadtxt(filename, ndmin=2)
+        if table.shape[1] < 3:
+            raise ValueError('%s has %d columns, 3 required' % (filename, table.shape[1]))
+        return cls(name, fiber_positions=table[:, :2], slit_positions=table[:, 2])
+
+    def _check_positions(self):
+        if self.fiber_positions is None or self.slit_positions is None:
+            raise ValueError('the positions of the fibers of %s are not loaded' % self.name)
+
+    def fiber_geometry(self, cover):
+        '''Geometry of the fibers illuminated with the current position of cover.
+
+        The geometry is computed once for each position of the cover,
+        its arrays are read-only.
+        '''
+        pos = cover.pos()
+        try:
+            return self._geometry[pos]
+        except KeyError:
+            self._check_positions()
+            mask = cover(self.fiber_positions)
+            positions = self.slit_positions[mask]
+            separation = np.empty_like(positions)
+            if len(positions) > 1:
+                separation[:-1] = np.diff(positions)
+                separation[-1] = separation[-2]
+            else:
+                separation[:] = 0.0
+            for arr in (mask, positions, separation):
+                arr.setflags(write=False)
+            geometry = FiberGeometry(positions, separation, mask)
+            self._geometry[pos] = geometry
+            return geometry
+
+    def fiber_index(self):
+        '''KD-tree of the positions of the fibers in the focal plane.'''
+        if self._tree is None:
+            self._check_positions()
+            self._tree = cKDTree(np.asarray(self.fiber_positions)[:, :2])
+        return self._tree
+
+    def target_weights(self, centers, sigmas, area, nsigma=NSIGMA):
+        '''Fraction of the flux of each target that enters each fiber.
+
+        The targets are gaussians, with centers (ntargets, 2) and
+        sigmas (ntargets,) in the focal plane, including the seeing.
+        area is the area of a fiber. Only the fibers within nsigma
+        sigmas of a target are evaluated. Returns a sparse matrix
+        of shape (ntargets, nfibers). The matrix is reused while the
+        targets, their sigmas and area do not change; it must not
+        be modified.
+        '''
+        centers = np.ascontiguousarray(centers, dtype='float').reshape(-1, 2)
+        sigmas = np.ascontiguousarray(sigmas, dtype='float').reshape(-1)
+        if len(sigmas) != len(centers):
+            raise ValueError('%d targets with %d sigmas' % (len(centers), len(sigmas)))
+        md5 = hashlib.md5(centers.tostring())
+        md5.update(sigmas.tostring())
+        key = (md5.hexdigest(), float(area), float(nsigma))
+        if self._weights is not None and self._weights[0] == key:
+            return self._weights[1]
+
+        tree = self.fiber_index()
+        positions = tree.data
+        rows = []
+        cols = []
+        vals = []
+        for idx, (center, sigma) in enumerate(zip(centers, sigmas)):
+            near = tree.query_ball_point(center, nsigma * sigma)
+            if not near:
+                continue
+            near = np.asarray(near)
+            r2 = ((positions[near] - center) ** 2).sum(axis=1)
+            rows.append(np.repeat(idx, len(near)))
+            cols.append(near)
+            vals.append(area / (2 * np.pi * sigma ** 2) * np.exp(-0.5 * r2 / sigma ** 2))
+
+        shape = (len(centers), len(positions))
+        if rows:
+            weights = sparse.csr_matrix((np.concatenate(vals),
+                                         (np.concatenate(rows), np.concatenate(cols))),
+                                        shape=shape)
+        else:
+            weights = sparse.csr_matrix(shape)
+        self._weights = (key, weights)
+        return weights
+
+    def fiber_flux(self, centers, sigmas, spectra, area, nsigma=NSIGMA):
+        '''Flux of the targets entering each fiber.
+
+        spectra (ntargets, nwavelengths) is the flux of each target,
+        see target_weights for the rest of the arguments. Returns
+        an array of shape (nfibers, nwavelengths).
+        '''
+        weights = self.target_weights(centers, sigmas, area, nsigma)
+        return np.asarray(weights.T.dot(spectra))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Rebuilt on demand
+        state['_tree'] = None
+        state['_weights'] = None
+        return state
+
+    def get_fiber_positions_on_detector(self, cover):
+        return self.fiber_geometry(cover).positions
 
     def __repr__(self):
         return "FiberBundle(name='%s')" % self.name
@@ -1,16 +1,42 @@
 
+import numpy as np
+
 from conectsim.devices.element import Element
+from conectsim.cache import Cache
 from .conelement import ConnectableElement
+from .spectralcube import SpectralCube
 import conectsim.optics.basenodes
 
 class OpticalElement(ConnectableElement):
     '''A generic optical element.'''
     def __init__(self, transmission, name=None):
         self.transmission_interp = transmission
+        # Transmission sampled in the grids of the cubes
+        self._curves = Cache(maxsize=4)
         super(OpticalElement, self).__init__(name=name)
 
+    def curve(self, cube):
+        '''Transmission sampled in the wavelength grid of cube.'''
+        def compute():
+            trans = np.asarray(self.transmission_interp(cube.wavelength), dtype='float')
+            trans = np.clip(trans, 0.0, None)
+            trans.flags.writeable = False
+            return trans
+        return self._curves.get(cube.grid, compute)
+
     def transform(self, illumination):
-        '''Transform the illumination passing through.'''
+        '''Transform the illumination passing through.
+
+        The spectra of a SpectralCube are multiplied in place
+        by the transmission, other illuminations pass unchanged.
+        '''
+        if not isinstance(illumination, SpectralCube):
+            return illumination
+        interp = self.transmission_interp
+        if callable(interp):
+            np.multiply(illumination.data, self.curve(illumination), out=illumination.data)
+        elif interp is not None and interp != 1.0:
+            illumination.data *= max(interp, 0.0)
         return illumination
 
     def entrance(self):
@@ -20,6 +46,20 @@ class OpticalElement(ConnectableElement):
         return self
 
 
+def path_transmission(path, wavelength):
+    '''Total transmission of the optical elements of path, sampled in wavelength.
+
+    A spectrum is passed once through the elements. The
+    returned array is read-only.
+    '''
+    cube = SpectralCube(np.ones((1, len(wavelength))), wavelength)
+    for element in path:
+        element.transform(cube)
+    trans = cube.data[0]
+    trans.flags.writeable = False
+    return trans
+
+
 class Filter(OpticalElement):
     '''A filter.'''
     def __init__(self, transmission, name=None):
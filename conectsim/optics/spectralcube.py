@@ -0,0 +1,26 @@
+
+'''Spectra of many fibers, passed through the optical elements.'''
+
+import hashlib
+
+import numpy as np
+
+
+def grid_key(wavelength):
+    '''A hashable key of the wavelength grid.'''
+    wavelength = np.ascontiguousarray(wavelength)
+    return wavelength.shape, hashlib.md5(wavelength.tostring()).hexdigest()
+
+
+class SpectralCube(object):
+    '''The spectra of the fibers, sampled in a common wavelength grid.
+
+    data has shape (nfibers, nwavelengths). The elements of the
+    light path modify data in place.
+    '''
+    def __init__(self, data, wavelength):
+        self.data = data
+        self.wavelength = wavelength
+        # Identifies the grid, the elements cache
+        # their transmission curves sampled on it
+        self.grid = grid_key(wavelength)
@@ -0,0 +1,76 @@
+'''Generation of repeated exposures in a pool of processes.'''
+
+import os
+import logging
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+_logger = logging.getLogger('control.parallel')
+
+# State of each worker process
+_worker = {}
+
+
+def _init_worker(rate_file, instrument, write):
+    if rate_file is None:
+        rate = None
+    else:
+        # Shared between the processes by the page cache
+        rate = np.load(rate_file, mmap_mode='r')
+    instrument.das.detector.set_input(rate)
+    _worker['instrument'] = instrument
+    _worker['write'] = write
+
+
+def _expose(job):
+    stream, exptime, task = job
+    instrument = _worker['instrument']
+    das = instrument.das
+    # The streams of the image are the ones it would use in a serial run
+    das.detector._stream = stream
+    # The reads of instrument.run, without computing the rate again
+    reads = ([data] for data in das.run(exptime))
+    return _worker['write'](instrument, reads, task)
+
+
+def run_parallel(instrument, exposure, tasks, jobs, write):
+    '''Run an exposure of the instrument for each task in jobs processes.
+
+    The noiseless image is computed once and shared through a
+    memory mapped temporary file. Each process runs the data
+    adquisition system of the instrument, drawing the same random
+    streams as a serial run of the exposures, and calls
+    write(instrument, reads, task), with the reads of the exposure
+    like the ones of instrument.run. write must be picklable.
+    Yields the results of write, in the order of the tasks.
+    '''
+    das = instrument.das
+    detector = das.detector
+    rate = instrument.illumination()
+    first = detector._stream
+    nstreams = das.streams(exposure)
+
+    rate_file = None
+    if rate is not None:
+        fd, rate_file = tempfile.mkstemp(suffix='.npy')
+        with os.fdopen(fd, 'wb') as fobj:
+            np.save(fobj, rate)
+    # The processes read the rate from the file
+    detector.set_input(None)
+    try:
+        pool = multiprocessing.Pool(jobs, _init_worker, (rate_file, instrument, write))
+        try:
+            jobs = [(first + idx * nstreams, exposure, task)
+                    for idx, task in enumerate(tasks)]
+            for result in pool.imap(_expose, jobs):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        detector.set_input(rate)
+        detector._stream = first + len(tasks) * nstreams
+        if rate_file is not None:
+            os.remove(rate_file)
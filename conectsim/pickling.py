@@ -0,0 +1,28 @@
+
+'''Support for pickling the objects of the simulator.
+
+Importing this module registers reducers for the
+scipy objects that cannot be pickled by default.
+'''
+
+import copy_reg
+
+from scipy.interpolate import interp1d
+
+
+def _interp1d_kind(interp):
+    kind = getattr(interp, '_kind', 'linear')
+    if kind == 'spline':
+        # interp1d stores the order of the spline, not the name
+        return interp._spline[2] if isinstance(interp._spline, tuple) else interp._spline.k
+    return kind
+
+
+def _reduce_interp1d(interp):
+    # interp1d keeps an unbound method for the kind of interpolation
+    args = (interp.x, interp.y, _interp1d_kind(interp), interp.axis,
+            interp.copy, interp.bounds_error, interp.fill_value)
+    return interp1d, args
+
+
+copy_reg.pickle(interp1d, _reduce_interp1d)
@@ -0,0 +1,187 @@
+
+'''Run observing blocks, grouping the exposures by configuration.'''
+
+import logging
+from collections import OrderedDict
+
+from .cache import freeze
+
+_logger = logging.getLogger('control.sequencer')
+
+
+class ExposureRequest(object):
+    '''An exposure with a configuration of the instrument.
+
+    after contains the indices, in the observing block, of the
+    requests that must run before this one.
+    '''
+    def __init__(self, configuration, exposure, after=()):
+        self.configuration = configuration
+        self.exposure = exposure
+        self.after = after
+
+
+# Over this number of explored states, schedule falls back to a greedy order
+MAX_STATES = 20000
+
+
+def _check(requests):
+    for idx, req in enumerate(requests):
+        for other in req.after:
+            if other < 0 or other >= len(requests) or other == idx:
+                raise ValueError('request %d cannot run after %r' % (idx, other))
+
+
+def _run_group(keys, deps, done, key):
+    '''Run all the requests with key that can run, return the new done set and the group.'''
+    done = set(done)
+    group = []
+    changed = True
+    while changed:
+        changed = False
+        for idx in range(len(keys)):
+            if idx not in done and keys[idx] == key and deps[idx] <= done:
+                done.add(idx)
+                group.append(idx)
+                changed = True
+    return frozenset(done), group
+
+
+def _ready(keys, deps, done):
+    '''The number of requests ready of each configuration, in order of the first.'''
+    ready = OrderedDict()
+    for idx in range(len(keys)):
+        if idx not in done and deps[idx] <= done:
+            ready[keys[idx]] = ready.get(keys[idx], 0) + 1
+    return ready
+
+
+def _greedy(keys, deps, current):
+    done = frozenset()
+    groups = []
+    while len(done) < len(keys):
+        ready = _ready(keys, deps, done)
+        if not ready:
+            raise ValueError('circular ordering constraints')
+        if current not in ready:
+            # The configuration with more requests ready, the first in the block on ties
+            order = list(ready)
+            current = max(order, key=lambda key: (ready[key], -order.index(key)))
+        done, group = _run_group(keys, deps, done, current)
+        groups.append(group)
+    return groups
+
+
+def schedule(requests, current=None):
+    '''Order the requests with the minimum number of changes of configuration.
+
+    current is the configuration of the instrument before the
+    requests, a change to it is not counted. The order respects
+    the constraints in the after attribute of the requests.
+    Returns a list of groups of indices of requests sharing
+    a configuration, in execution order.
+
+    The search is exact, it explores the sets of requests done
+    after each group, running in each group all the requests that
+    can run. If it explores more than MAX_STATES sets, the order is
+    built instead by a greedy heuristic, staying in the current
+    configuration while possible and else changing to the
+    configuration with more requests ready.
+    '''
+    _check(requests)
+    keys = [freeze(req.configuration) for req in requests]
+    deps = [frozenset(req.after) for req in requests]
+    current = None if current is None else freeze(current)
+
+    # Breadth first search, by number of changes of configuration
+    start = (frozenset(), current)
+    previous = {start: None}
+    level = [start]
+    explored = 0
+    while level:
+        following = []
+        for state in level:
+            done, key = state
+            if len(done) == len(keys):
+                groups = []
+                while previous[state] is not None:
+                    state, group = previous[state]
+                    groups.append(group)
+                groups.reverse()
+                return groups
+            explored += 1
+            if explored > MAX_STATES:
+                return _greedy(keys, deps, current)
+            ready = list(_ready(keys, deps, done))
+            # Staying in the configuration is free, done first
+            if key in ready:
+                ready.remove(key)
+                ready.insert(0, key)
+            for other in ready:
+                newdone, group = _run_group(keys, deps, done, other)
+                newstate = (newdone, other)
+                if newstate in previous:
+                    continue
+                previous[newstate] = (state, group)
+                if other == key:
+                    level.append(newstate)
+                else:
+                    following.append(newstate)
+        level = following
+    raise ValueError('circular ordering constraints')
+
+
+def _cache_info(instrument):
+    info = getattr(instrument, 'cache_info', None)
+    if info is None:
+        return {}
+    return info()
+
+
+class Sequencer(object):
+    '''Run observing blocks with a control system.
+
+    The exposures of the block are reordered to minimize the
+    changes of configuration, and run in groups sharing a
+    configuration.
+    '''
+    def __init__(self, control, instrument):
+        self.control = control
+        self.instrument = instrument
+        # The last configuration applied to the instrument
+        self.configuration = None
+
+    def run(self, requests, mode='SEQUENCE', target=''):
+        '''Run the requests in an observing block.
+
+        Returns a report for each group, a dictionary with the
+        configuration, the indices of the requests, the names
+        of the images of each request and the hits and misses of
+        the caches of the instrument during the group.
+        '''
+        self.control.create_ob(mode, target)
+        self.control.start_ob()
+        reports = []
+        try:
+            for group in schedule(requests, self.configuration):
+                configuration = requests[group[0]].configuration
+                self.instrument.configure(configuration)
+                self.configuration = configuration
+                before = _cache_info(self.instrument)
+                names = {}
+                for idx in group:
+                    names[idx] = self.control.run(self.instrument, requests[idx].exposure)
+                after = _cache_info(self.instrument)
+                caches = {}
+                for name, (hits, misses, _) in after.items():
+                    hits0, misses0, _ = before.get(name, (0, 0, 0))
+                    caches[name] = (hits - hits0, misses - misses0)
+                _logger.info('group of %d exposures, cache hits/misses %s',
+                             len(group), caches)
+                reports.append({'configuration': configuration,
+                                'requests': group,
+                                'names': names,
+                                'caches': caches})
+        finally:
+            self.control.end_ob()
+        return reports
@@ -0,0 +1,174 @@
+
+'''A long running simulator, serving exposures over a UNIX socket.
+
+Each request is a line with a JSON object::
+
+    {"instrument": "/data/conf.yaml", "targets": "targets.yaml",
+     "conditions": "conditions.yaml", "parameters": "parameters.yaml",
+     "exposure": 100, "nimages": 1}
+
+The paths of the configuration files are relative to the directory
+of the server. "parameters" and "conditions" can be also objects
+with the contents of the files. The server answers each request
+with a line::
+
+    {"status": "ok", "files": ["/dest/r00001.fits"]}
+
+or, if the request fails::
+
+    {"status": "error", "message": "..."}
+
+In container mode, each file is a pair [container, extension].
+
+The instruments are built once and kept with their caches between
+requests. The requests are served one at a time.
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import logging
+import argparse
+import SocketServer
+
+from .user import try_open, load_targets, connect_atmosphere
+from .builder import instrument_builder
+from conectsim.optics.obscond import conditions_builder
+from .control import ControlSystem
+from .cache import Cache, freeze
+
+_logger = logging.getLogger('conectsim.server')
+
+
+class Simulator(object):
+    '''An instrument built from its configuration files, with its targets.'''
+    def __init__(self, instrument_file, targets_file):
+        self.conf = try_open(instrument_file)
+        if not self.conf:
+            raise IOError('cannot read instrument %s' % instrument_file)
+        self.data_dir = os.path.dirname(instrument_file)
+        self.instrument = instrument_builder(self.conf, self.data_dir)
+        targetconf = try_open(targets_file)
+        if not targetconf:
+            raise IOError('cannot read targets %s' % targets_file)
+        self.instrument.set_targets(load_targets(targetconf[0], self.data_dir))
+        connect_atmosphere(self.instrument)
+        self._conditions = None
+
+    def set_conditions(self, occonf):
+        '''Build the observing conditions, if they have changed.'''
+        key = freeze(occonf)
+        if key != self._conditions:
+            oc = conditions_builder(self.conf, occonf, self.data_dir)
+            self.instrument.set_observing_conditions(oc)
+            self._conditions = key
+
+
+class SimulatorServer(SocketServer.UnixStreamServer):
+    '''Serve exposures of the simulators kept in memory.
+
+    At most maxsims simulators are kept, the least recently
+    used is discarded first.
+    '''
+    allow_reuse_address = True
+
+    def __init__(self, path, destdir, maxsims=4):
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+        self.path = path
+        self.control = ControlSystem(destdir=destdir)
+        self.simulators = Cache(maxsims)
+        self.files = Cache(64)
+
+    def load(self, value):
+        '''Return the contents of a YAML file, or value if it is not a path.'''
+        if not isinstance(value, basestring):
+            return value
+        filename = os.path.abspath(value)
+        # Keyed also by mtime, the files can be edited between requests
+        key = (filename, os.path.getmtime(filename))
+        conf = self.files.get(key, lambda: try_open(filename))
+        if not conf:
+            raise IOError('cannot read %s' % filename)
+        return conf[0]
+
+    def simulate(self, request):
+        '''Run the exposures in the request, return the names of the images.'''
+        if 'exposure' not in request:
+            raise ValueError('the request has no exposure time')
+        instrument_file = os.path.abspath(request['instrument'])
+        targets_file = os.path.abspath(request['targets'])
+        # Keyed also by mtime, like the files in load
+        key = (instrument_file, os.path.getmtime(instrument_file),
+               targets_file, os.path.getmtime(targets_file))
+        simulator = self.simulators.get(
+            key, lambda: Simulator(instrument_file, targets_file)
+        )
+        simulator.set_conditions(self.load(request['conditions']))
+        opconf = self.load(request['parameters'])
+        names = []
+        for _ in range(request.get('nimages', 1)):
+            simulator.instrument.configure(opconf)
+            names.extend(self.control.run(simulator.instrument, request['exposure']))
+        return [self.control.path(name) for name in names]
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    '''Read requests and write the answers, one per line.'''
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+                files = self.server.simulate(request)
+                answer = {'status': 'ok', 'files': files}
+            except Exception as error:
+                _logger.exception('error in request %s', line)
+                answer = {'status': 'error', 'message': str(error)}
+            self.wfile.write(json.dumps(answer) + '\n')
+            self.wfile.flush()
+
+
+def main(args=None):
+    '''Entry point for the conectsim server.'''
+
+    parser = argparse.ArgumentParser(
+        description='Simulator server of conectsim',
+        prog='conectsim-server'
+    )
+    parser.add_argument('socket', metavar="PATH",
+                    help="PATH of the UNIX socket")
+    parser.add_argument('--max-simulators', metavar="INT", type=int, default=4,
+                    help="Number of instruments kept in memory")
+    parser.add_argument('-l','--loglevel', type=str, default='info',
+                    choices=['DEBUG','debug','INFO','info','ERROR','error','CRITICAL','critical'],
+                    help="Logging level")
+    parser.add_argument('--dest-dir', help="directory to write out put images",
+        default=os.getcwd())
+
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+
+    server = SimulatorServer(args.socket, os.path.abspath(args.dest_dir),
+                             args.max_simulators)
+    _logger.info('serving on %s', args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,120 @@
-
+import itertools
+import threading
 import traceback
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class _Slot(object):
+    '''A callback, weakly referenced if it is a bound method.'''
+    def __init__(self, callback):
+        obj = getattr(callback, 'im_self', None)
+        if obj is None:
+            self._ref = None
+            self._func = callback
+            self.key = id(callback)
+        else:
+            # A strong reference to the method would keep
+            # the receiver alive as long as the sender
+            self._ref = weakref.ref(obj)
+            self._func = callback.im_func
+            self.key = (id(obj), self._func)
+
+    def target(self):
+        '''Return the callable, or None if the receiver is dead.'''
+        if self._ref is None:
+            return self._func
+        obj = self._ref()
+        if obj is None:
+            return None
+        return self._func.__get__(obj, type(obj))
+
+
+class _Batch(threading.local):
+    '''The open batches of a thread.'''
+    def __init__(self):
+        self.depth = 0
+        # Callbacks deferred while a batch is open, key -> (slot, args, kwds)
+        self.pending = OrderedDict()
+
+# The signals emitted in other threads are not deferred
+_batch = _Batch()
+
+
+@contextmanager
+def batch():
+    '''Defer the callbacks of the signals emitted inside the block.
+
+    When the outermost block exits, each callback is called once,
+    with the arguments of its last emission, in the order of
+    the first emissions. Only the signals emitted by the thread
+    of the block are deferred.
+    '''
+    _batch.depth += 1
+    try:
+        yield
+    finally:
+        _batch.depth -= 1
+        if _batch.depth == 0:
+            pending = _batch.pending
+            _batch.pending = OrderedDict()
+            for slot, args, kwds in pending.values():
+                _call(slot, args, kwds)
+
+
+def _call(slot, args, kwds):
+    callback = slot.target()
+    if callback is None:
+        return
+    try:
+        res = callback(*args, **kwds)
+        # we can use the result value
+        # to disable this callback...
+        # not yet implemented
+    except TypeError:
+        traceback.print_exc()
+
 
 class Signal(object):
-    '''Signal used for callbacks.'''
+    '''Signal used for callbacks.
+
+    Bound methods are referenced weakly, they are disconnected
+    when their object is collected.
+    '''
+    _handles = itertools.count()
+
     def __init__(self):
-        self.callbacks = []
-    
+        self._slots = OrderedDict()
+
+    @property
+    def callbacks(self):
+        '''The live callbacks.'''
+        return [cb for cb in (slot.target() for slot in self._slots.values())
+                if cb is not None]
+
     def connect(self, callback):
-        self.callbacks.append(callback)
-        return len(self.callbacks) - 1
+        '''Connect callback, return a handle to delete it.'''
+        handle = self._handles.next()
+        self._slots[handle] = _Slot(callback)
+        return handle
 
-    def delete(self, idx):
-        self.callbacks.pop(idx)
+    def delete(self, handle):
+        del self._slots[handle]
 
-    def emit(self, *args, **kwds):
-        for c in self.callbacks:
-            try:
-                res = c(*args, **kwds)
-                # we can use the result value
-                # to disable this callback...
-                # not yet implemented
-            except TypeError:
-                traceback.print_exc()
+    def __reduce__(self):
+        # The callbacks are not pickled, the receivers
+        # connect them again when they are unpickled
+        return Signal, ()
 
+    def emit(self, *args, **kwds):
+        deferred = _batch.depth > 0
+        for handle, slot in self._slots.items():
+            if slot.target() is None:
+                del self._slots[handle]
+            elif deferred:
+                pending = _batch.pending
+                # The last arguments are kept, in the place of the first emission
+                pending[slot.key] = (slot, args, kwds)
+            else:
+                _call(slot, args, kwds)
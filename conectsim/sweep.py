@@ -0,0 +1,196 @@
+
+'''Parameter sweeps of the simulator.
+
+A sweep is described in a YAML file::
+
+    instrument: conf.yaml
+    conditions: conditions.yaml
+    parameters: parameters.yaml
+    targets: targets.yaml
+    nimages: 1
+    grid:
+      vph: [VPH405_LR, VPH570_LR]
+      bundle: [LCB, MOS]
+      exposure: [10, 100]
+      airmass: [1.0, 1.5]
+
+The relative paths are relative to the sweep file. Each combination
+of the values in the grid is a job. The keys of the grid present in
+the observing parameters override them, 'exposure' is the exposure
+time and the rest of the keys override the observing conditions.
+The files of each job are listed in the manifest, as pairs
+[container, extension] in container mode.
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import logging
+import argparse
+import itertools
+import multiprocessing
+
+from .user import try_open, load_targets, connect_atmosphere
+from .builder import instrument_builder
+from conectsim.optics.obscond import conditions_builder
+from .control import ControlSystem, name_generator
+from .cache import freeze
+
+_logger = logging.getLogger('conectsim.sweep')
+
+# The list of finished jobs, in the destination directory
+MANIFEST = 'manifest.jsonl'
+
+# State of each worker process
+_worker = {}
+
+
+def expand_grid(grid, parameters):
+    '''Expand the grid into a list of jobs, dictionaries of parameter values.
+
+    The jobs sharing a configuration of the instrument are consecutive.
+    '''
+    def order(name):
+        if name in parameters:
+            return 0, name
+        if name == 'exposure':
+            return 2, name
+        return 1, name
+
+    names = sorted(grid, key=order)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[grid[name] for name in names])]
+
+
+def job_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def read_manifest(filename):
+    '''Return the keys of the finished jobs.'''
+    done = set()
+    if os.path.exists(filename):
+        with open(filename) as fd:
+            for line in fd:
+                line = line.strip()
+                if line:
+                    done.add(job_key(json.loads(line)['params']))
+    return done
+
+
+def _init_worker(spec, dest_dir):
+    data_dir = os.path.dirname(spec['instrument'])
+    conf = try_open(spec['instrument'])
+    instrument = instrument_builder(conf, data_dir)
+    targetconf = try_open(spec['targets'])[0]
+    instrument.set_targets(load_targets(targetconf, data_dir))
+    connect_atmosphere(instrument)
+
+    _worker['conf'] = conf
+    _worker['data_dir'] = data_dir
+    _worker['instrument'] = instrument
+    _worker['occonf'] = try_open(spec['conditions'])[0]
+    _worker['opconf'] = try_open(spec['parameters'])[0]
+    _worker['nimages'] = spec.get('nimages', 1)
+    _worker['conditions'] = None
+    _worker['control'] = ControlSystem(destdir=dest_dir)
+
+
+def _run_job(job):
+    idx, params = job
+    instrument = _worker['instrument']
+    control = _worker['control']
+    opconf = dict(_worker['opconf'])
+    occonf = dict(_worker['occonf'])
+    exposure = params['exposure']
+    for key, value in params.items():
+        if key in opconf:
+            opconf[key] = value
+        elif key != 'exposure':
+            occonf[key] = value
+
+    # The observing conditions are built again only if they change
+    conditions = freeze(occonf)
+    if conditions != _worker['conditions']:
+        oc = conditions_builder(_worker['conf'], occonf, _worker['data_dir'])
+        instrument.set_observing_conditions(oc)
+        _worker['conditions'] = conditions
+    if 'airmass' in occonf:
+        control.meta['pointing.airmass'] = occonf['airmass']
+
+    control.ng = name_generator('s%05d-%%03d.fits' % idx)
+    instrument.configure(opconf)
+    names = []
+    for _ in range(_worker['nimages']):
+        names.extend(control.run(instrument, exposure))
+    return idx, params, names
+
+
+def load_spec(filename):
+    '''Read the sweep file, making its paths absolute.'''
+    spec = try_open(filename)[0]
+    base = os.path.dirname(os.path.abspath(filename))
+    for key in ['instrument', 'conditions', 'parameters', 'targets']:
+        spec[key] = os.path.join(base, spec[key])
+    return spec
+
+
+def run_sweep(spec, dest_dir, jobs=1):
+    '''Run the jobs of the sweep not present in the manifest.'''
+    if 'exposure' not in spec['grid']:
+        raise ValueError('the grid of the sweep has no exposure times')
+    manifest = os.path.join(dest_dir, MANIFEST)
+    opconf = try_open(spec['parameters'])[0]
+    grid = expand_grid(spec['grid'], opconf)
+    done = read_manifest(manifest)
+    pending = [(idx, params) for idx, params in enumerate(grid)
+               if job_key(params) not in done]
+    _logger.info('%d jobs in the sweep, %d pending', len(grid), len(pending))
+    if not pending:
+        return
+
+    pool = multiprocessing.Pool(jobs, _init_worker, (spec, dest_dir))
+    # Consecutive jobs share the configuration of the instrument
+    chunksize = max(1, len(pending) // (4 * jobs))
+    try:
+        with open(manifest, 'a') as fd:
+            for idx, params, names in pool.imap_unordered(_run_job, pending, chunksize):
+                record = {'job': idx, 'params': params, 'files': names}
+                fd.write(json.dumps(record, sort_keys=True) + '\n')
+                fd.flush()
+                _logger.info('job %d finished, %s', idx, params)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(args=None):
+    '''Entry point for the conectsim sweeps.'''
+
+    parser = argparse.ArgumentParser(
+        description='Parameter sweeps of conectsim',
+        prog='conectsim-sweep'
+    )
+    parser.add_argument('sweep', metavar="FILE",
+                    help="FILE with the description of the sweep")
+    parser.add_argument('-j','--jobs', metavar="INT", type=int, default=1,
+                    help="Number of processes running the jobs")
+    parser.add_argument('-l','--loglevel', type=str, default='info',
+                    choices=['DEBUG','debug','INFO','info','ERROR','error','CRITICAL','critical'],
+                    help="Logging level")
+    parser.add_argument('--dest-dir', help="directory to write out put images",
+        default=os.getcwd())
+
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+
+    if try_open(args.sweep) is None:
+        sys.exit(1)
+    spec = load_spec(args.sweep)
+    run_sweep(spec, os.path.abspath(args.dest_dir), args.jobs)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''Targets with gaussian profiles in the focal plane.'''
+
+import math
+
+import numpy as np
+
+from conectsim.optics.fiberlayout import NSIGMA
+
+# Ratio of the FWHM to the sigma of a gaussian
+FWHM_SIGMA = 2 * math.sqrt(2 * math.log(2))
+
+
+class GaussianTarget(object):
+    '''A target with a gaussian profile.
+
+    center is the (x, y) of the target in the focal plane, sigma
+    the sigma of its profile without seeing and spectrum its flux
+    in each wavelength.
+    '''
+    def __init__(self, center, sigma, spectrum):
+        self.center = np.asarray(center, dtype='float')
+        self.sigma = float(sigma)
+        self.spectrum = np.asarray(spectrum, dtype='float')
+
+    def gaussian(self, seeing):
+        '''Center, sigma and spectrum of the target seen with seeing, a FWHM.'''
+        sigma = math.hypot(self.sigma, seeing / FWHM_SIGMA)
+        return self.center, sigma, self.spectrum
+
+
+class GaussianTargetList(object):
+    '''The gaussian targets of the focal plane.'''
+    def __init__(self, targets):
+        self.targets = list(targets)
+
+    def gaussians(self, seeing):
+        '''Centers (ntargets, 2), sigmas (ntargets,) and spectra of the targets seen with seeing.'''
+        if not self.targets:
+            raise ValueError('no targets')
+        centers, sigmas, spectra = zip(*[target.gaussian(seeing) for target in self.targets])
+        return np.array(centers), np.array(sigmas), np.array(spectra)
+
+    def dense_flux(self, positions, area, seeing):
+        '''Flux of the targets in fibers of area at positions (nfibers, 2).
+
+        Every target is evaluated in every fiber.
+        '''
+        centers, sigmas, spectra = self.gaussians(seeing)
+        positions = np.asarray(positions, dtype='float')
+        r2 = ((positions[:, np.newaxis, :] - centers) ** 2).sum(axis=2)
+        weights = area / (2 * math.pi * sigmas ** 2) * np.exp(-0.5 * r2 / sigmas ** 2)
+        return weights.dot(spectra)
+
+
+def layout_flux(bundle, targets, seeing, area, nsigma=NSIGMA):
+    '''Flux of targets in each fiber of area of bundle, seen with seeing.
+
+    The targets give their gaussian profiles, gaussians(seeing), like
+    GaussianTargetList. The flux of each target is only evaluated in
+    the fibers within nsigma sigmas, see FiberBundle.fiber_flux.
+    Returns an array of shape (nfibers, nwavelengths).
+    '''
+    centers, sigmas, spectra = targets.gaussians(seeing)
+    return bundle.fiber_flux(centers, sigmas, spectra, area, nsigma)
@@ -0,0 +1,85 @@
+
+'''A tree of dictionaries, accessed with dotted keys.'''
+
+
+class TreeDict(object):
+    '''A tree of dictionaries, accessed with dotted keys.
+
+    tree['a.b'] is tree['a']['b']. snapshot() returns a copy of
+    the tree that shares its branches with the original. A shared
+    branch is copied the first time it is modified, in either tree.
+    The branches returned by tree['a'] must not be modified directly.
+    '''
+    def __init__(self, data=None):
+        self._root = {}
+        # Branches that are not shared with other trees
+        self._owned = {id(self._root): self._root}
+        if data:
+            for key, value in data.items():
+                self[key] = value
+
+    def _branch(self, path):
+        '''Return the branch at path, ready to be modified.'''
+        node = self._root
+        for key in path:
+            child = node.get(key)
+            if not isinstance(child, dict):
+                child = {}
+            elif id(child) in self._owned:
+                node = child
+                continue
+            else:
+                child = dict(child)
+            node[key] = child
+            self._owned[id(child)] = child
+            node = child
+        return node
+
+    def __getitem__(self, key):
+        node = self._root
+        for part in key.split('.'):
+            node = node[part]
+        return node
+
+    def __setitem__(self, key, value):
+        path = key.split('.')
+        self._branch(path[:-1])[path[-1]] = value
+
+    def __delitem__(self, key):
+        path = key.split('.')
+        del self._branch(path[:-1])[path[-1]]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except (KeyError, TypeError):
+            return default
+
+    def keys(self):
+        return self._root.keys()
+
+    def __getstate__(self):
+        return self._root
+
+    def __setstate__(self, state):
+        self._root = state
+        self._owned = {id(self._root): self._root}
+
+    def snapshot(self):
+        '''Return a copy of the tree, sharing the branches.'''
+        other = TreeDict()
+        other._root = dict(self._root)
+        other._owned = {id(other._root): other._root}
+        # From now on, the branches are shared
+        self._owned = {id(self._root): self._root}
+        return other
+
+    def __repr__(self):
+        return 'TreeDict(%r)' % self._root
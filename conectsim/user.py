@@ -9,15 +9,15 @@ import hashlib
 import cPickle as pickle
 import errno
 
-import yaml
-
-from .builder import instrument_builder
-from conectsim.optics.obscond import conditions_builder, Atmosphere
-from .focal_plane import GaussianTar, TargetContainer
-from .control import ControlSystem
+# The modules of the simulator import numpy, scipy and astropy,
+# they are imported in main, only if a simulation runs
 
 _logger = logging.getLogger("conectsim")
 
+# Changes when the attributes of the pickled instrument change,
+# the instruments in the cache are built again
+CACHE_VERSION = 7
+
 def make_sure_path_exists(path):
     try:
         os.makedirs(path)
@@ -25,15 +25,73 @@ def make_sure_path_exists(path):
         if exception.errno != errno.EEXIST:
             raise
 
+def user_cache_dir():
+    '''The directory of the caches of conectsim.'''
+    home_dir = os.getenv('HOME', '/')
+    cache_base = os.getenv('XDG_CACHE_HOME', os.path.join(home_dir, '.cache'))
+    return os.path.join(cache_base, 'conectsim')
+
+def _private_dir(path):
+    '''Create the directory path, return True if only the user can write in it.'''
+    try:
+        os.makedirs(path, 0o700)
+    except (OSError, IOError) as exception:
+        if exception.errno != errno.EEXIST:
+            return False
+    stat = os.stat(path)
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+def load_yaml(filename):
+    '''Return the documents in a YAML file.
+
+    The parsed documents are cached in the cache directory of
+    the user, keyed by the hash of the contents of the file.
+    The cache is not used if other users can write in it, the
+    cached documents are unpickled.
+    '''
+    with open(filename, 'rb') as fd:
+        text = fd.read()
+    cache_dir = user_cache_dir()
+    cache_file = None
+    if _private_dir(cache_dir):
+        cache_file = os.path.join(cache_dir, 'yaml-%s' % hashlib.md5(text).hexdigest())
+    else:
+        _logger.debug('%s is not private, YAML files are not cached', cache_dir)
+
+    if cache_file is not None:
+        try:
+            with open(cache_file, 'rb') as fd:
+                conf = pickle.load(fd)
+            _logger.debug('loading %s from %s', filename, cache_file)
+            return conf
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+    import yaml
+    loader = getattr(yaml, 'CLoader', yaml.Loader)
+    _logger.debug('loading from %s', filename)
+    conf = list(yaml.load_all(text, Loader=loader))
+    if cache_file is None:
+        return conf
+    tmpname = '%s.%d' % (cache_file, os.getpid())
+    try:
+        with open(tmpname, 'wb') as fd:
+            pickle.dump(conf, fd, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, cache_file)
+    except (IOError, OSError):
+        # A full or read-only cache
+        pass
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+    return conf
+
 def try_open(filename):
     if filename is None:
         return None
     try:
-        with open(filename) as fd:
-            _logger.debug('loading from %s', filename)
-            conf = list(yaml.load_all(fd))
-            return conf
-    except IOError as error:
+        return load_yaml(filename)
+    except (IOError, OSError) as error:
         print(error)
     return None
 
@@ -48,10 +106,82 @@ def md5_from_file(filename, block=4096):
     return md5.hexdigest()
                 
 
+def referenced_files(conf, data_dir):
+    '''Return the data files referenced in the configuration.'''
+    files = set()
+    pending = [conf]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, dict):
+            pending.extend(node.values())
+        elif isinstance(node, (list, tuple)):
+            pending.extend(node)
+        elif isinstance(node, basestring):
+            filename = os.path.join(data_dir, node)
+            if os.path.isfile(filename):
+                files.add(os.path.abspath(filename))
+    return sorted(files)
+
+def md5_from_conf(data_file, conf, data_dir):
+    '''Hash of the configuration file and the data files it references.'''
+    md5 = hashlib.md5()
+    md5.update(str(CACHE_VERSION))
+    for filename in [data_file] + referenced_files(conf, data_dir):
+        md5.update(filename)
+        md5.update(md5_from_file(filename))
+    return md5.hexdigest()
+
 def save_megara_in_cache(cache_dir, jash, megara):
     make_sure_path_exists(cache_dir)
-    with open(os.path.join(cache_dir, jash), 'w+') as fd:
-        pickle.dump(megara, fd)
+    # Written in a temporary file and renamed,
+    # concurrent runs never read a partial file
+    filename = os.path.join(cache_dir, jash)
+    tmpname = '%s.%d' % (filename, os.getpid())
+    try:
+        with open(tmpname, 'wb') as fd:
+            pickle.dump(megara, fd, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+def load_megara_from_cache(cache_dir, jash):
+    filename = os.path.join(cache_dir, jash)
+    if not _private_dir(cache_dir):
+        # Unpickling runs code, a file written by other users is not loaded
+        _logger.warn('%s is not private, the cache is not used', cache_dir)
+        return None
+    try:
+        with open(filename, 'rb') as fd:
+            return pickle.load(fd)
+    except (IOError, EOFError):
+        return None
+    except Exception as error:
+        # Stale pickles of old versions of the code
+        _logger.warn('cannot load %s from cache: %s', filename, error)
+        return None
+
+def load_targets(targetconf, data_dir):
+    '''Create the targets described in the targets configuration.'''
+    from .focal_plane import GaussianTar, TargetContainer
+
+    target_list = []
+    if targetconf['targets']:
+        for key, target in targetconf['targets'].items():
+            target_list.append(GaussianTar(target[0],
+                        target[1],
+                        os.path.join(data_dir, 'spectra',target[2]),
+                    target[3],
+                    target[4])
+                    )
+    return TargetContainer(target_list)
+
+def connect_atmosphere(instrument):
+    '''Put the atmosphere in front of the telescope of instrument.'''
+    # FIXME: this is a hack
+    from conectsim.optics.obscond import Atmosphere
+    atm = Atmosphere()
+    atm.connect(instrument.telescope)
 
 def restricted_float(x):
     x = float(x)
@@ -78,9 +208,13 @@ def main(args=None):
                     help="Exposure time per image (in seconds) [0,36000]")
     parser.add_argument('-n','--nimages', metavar="INT", type=int, default=1,
                     help="Number of images to generate")
+    parser.add_argument('-j','--jobs', metavar="INT", type=int, default=1,
+                    help="Number of processes generating the images")
     parser.add_argument('-l','--loglevel', type=str, default='debug',
                     choices=['DEBUG','debug','INFO','info','ERROR','error','CRITICAL','critical'],
                     help="Logging level")
+    parser.add_argument('--no-cache', action='store_true',
+                    help="Build the instrument, do not use the cache")
     parser.add_argument('--dest-dir', help="directory to write out put images",
         default=os.getcwd())
     parser.add_argument('-v','--version', action='version', version='%(prog)s 0.1', 
@@ -88,6 +222,12 @@ def main(args=None):
     
     args = parser.parse_args(args)
     
+    from .builder import instrument_builder
+    from conectsim.optics.obscond import conditions_builder
+    from .control import ControlSystem
+    # Registers the reducers of the scipy interpolators
+    from . import pickling
+
     numeric_level = getattr(logging, args.loglevel.upper(), None)
     if not isinstance(numeric_level, int):
         raise ValueError('Invalid log level: %s' % args.loglevel)
@@ -103,7 +243,7 @@ def main(args=None):
     home_dir = os.getenv('HOME', '/')
     # Cache dir
     cache_base = os.getenv('XDG_CACHE_HOME', os.path.join(home_dir, '.cache'))
-    cache_dir = os.path.join(cache_base, 'conectsim')
+    cache_dir = user_cache_dir()
     # Config dir
     config_base = os.getenv('XDG_CONFIG_HOME', os.path.join(home_dir, '.config'))
     config_dir = os.path.join(cache_base, 'conectsim')
@@ -137,16 +277,25 @@ def main(args=None):
     _logger.info('Starting CONNECT operations.')
     _logger.info('DATA dir is %s', data_dir)
     _logger.info('Destination for results is %s', args.dest_dir)
-    try:
-        meg = instrument_builder(conf, data_dir)
-    except KeyError:
-        sys.exit(1)
+    jash = md5_from_conf(data_file, conf, data_dir)
+    meg = None
+    if not args.no_cache:
+        meg = load_megara_from_cache(cache_dir, jash)
+    if meg is not None:
+        _logger.debug('Loaded conect instance from cache')
+    else:
+        try:
+            meg = instrument_builder(conf, data_dir)
+        except KeyError:
+            sys.exit(1)
 
-    # try to save conect in cache
-    #_logger.debug('Save conect instance in cache')
-    #jash = md5_from_file(data_file)
-    # meg object still contains attributes that cannot be pickled
-    #save_conect_in_cache(cache_dir, jash, meg)
+        if not args.no_cache:
+            _logger.debug('Save conect instance in cache')
+            try:
+                save_megara_in_cache(cache_dir, jash, meg)
+            except Exception as error:
+                # The simulation runs without the cache
+                _logger.warn('cannot save the instrument in %s: %s', cache_dir, error)
         
     # Reading the observing conditions conf file
     # Try to read from the command line
@@ -176,24 +325,13 @@ def main(args=None):
         _logger.warn('No targets are provided')
 
     # Reading the targets file 
-    target_list = []
-    if targetconf['targets']:
-        for key, target in targetconf['targets'].items():
-            target_list.append(GaussianTar(target[0],
-                        target[1],
-                        os.path.join(data_dir, 'spectra',target[2]),
-                    target[3],
-                    target[4])
-                    )
-    target_list = TargetContainer(target_list)
+    target_list = load_targets(targetconf, data_dir)
     meg.set_targets(target_list)
     
     # Setting observing conditions
     meg.set_observing_conditions(oc)
 
-    # FIXME: this is a hack
-    atm = Atmosphere()
-    atm.connect(meg.telescope)
+    connect_atmosphere(meg)
     # done
 
     # STILL TO BE DONE - where are the other files for the vphs defined?
@@ -204,16 +342,23 @@ def main(args=None):
 
     cs = ControlSystem(destdir=args.dest_dir)
     cs.register('CONNECT', meg)
-    # This would be a sequence
-    for _ in range(args.nimages):
+    if args.jobs > 1:
         instrument = cs.get('CONNECT')
-        # configure instrument here...
         instrument.configure(opconf)
-        # done
-        # run exposure here
-        cs.run(instrument, args.exposure)
-        # done
-        # FITS files are stored by CS
+        # The noiseless image is computed once,
+        # the noise is generated in parallel
+        cs.parallel_run(instrument, args.exposure, args.nimages, args.jobs)
+    else:
+        # This would be a sequence
+        for _ in range(args.nimages):
+            instrument = cs.get('CONNECT')
+            # configure instrument here...
+            instrument.configure(opconf)
+            # done
+            # run exposure here
+            cs.run(instrument, args.exposure)
+            # done
+            # FITS files are stored by CS
 
     _logger.info('CONNECT operations finished.')
 
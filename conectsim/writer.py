@@ -0,0 +1,104 @@
+
+'''Writing of the output files in background threads.'''
+
+import logging
+import threading
+import Queue
+
+import numpy as np
+
+_logger = logging.getLogger('control.writer')
+
+
+class WriterPool(object):
+    '''A pool of threads writing files.
+
+    The files wait to be written in a bounded queue, submit blocks
+    while the queue is full. If callback is not None,
+    callback(name, error) is called from the writer thread when
+    each file is done; error is None if the file was written.
+    '''
+    def __init__(self, nworkers=2, maxsize=4, callback=None):
+        self.nworkers = nworkers
+        self.callback = callback
+        self._queue = Queue.Queue(maxsize)
+        self._workers = []
+        self._lock = threading.Lock()
+        self._errors = []
+
+    def _start(self):
+        for _ in range(self.nworkers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            name, func, args = job
+            error = None
+            try:
+                func(*args)
+                _logger.debug('%s written', name)
+            except Exception as exc:
+                error = exc
+                _logger.error('error writing %s: %s', name, exc)
+                with self._lock:
+                    self._errors.append((name, exc))
+            if self.callback is not None:
+                try:
+                    self.callback(name, error)
+                except Exception:
+                    _logger.exception('error in callback for %s', name)
+            self._queue.task_done()
+
+    def submit(self, name, func, *args):
+        '''Queue the call func(*args), that writes the file name.'''
+        if not self._workers:
+            self._start()
+        self._queue.put((name, func, args))
+
+    def flush(self):
+        '''Wait until all the queued files are done.
+
+        Return the list of (name, error) of the files
+        that failed since the previous flush.
+        '''
+        self._queue.join()
+        with self._lock:
+            errors, self._errors = self._errors, []
+        return errors
+
+    def close(self):
+        '''Flush and stop the threads.'''
+        errors = self.flush()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        return errors
+
+
+class FramePool(object):
+    '''A fixed number of preallocated frames, reused once written.
+
+    get blocks while all the frames are in use.
+    '''
+    def __init__(self, shape, dtype, nframes):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.nframes = nframes
+        self._free = Queue.Queue()
+        for _ in range(nframes):
+            self._free.put(np.empty(shape, dtype=dtype))
+
+    def get(self):
+        return self._free.get()
+
+    def release(self, frame):
+        self._free.put(frame)
@@ -0,0 +1,57 @@
+'''Compiled plans of the optical paths.'''
+
+import gc
+import weakref
+import cPickle as pickle
+
+from conectsim.optics.basenodes import Node, Source, Sink
+
+
+class Lamp(Source):
+    def create(self):
+        return 1
+
+
+class Double(Node):
+    def transform(self, data):
+        return 2 * data
+
+
+class Detector(Sink):
+    def transform(self, data):
+        return data + 1
+
+
+def chain():
+    lamp, double, detector = Lamp(), Double(), Detector()
+    lamp.connect(double)
+    double.connect(detector)
+    return lamp, double, detector
+
+
+def test_plan():
+    lamp, double, detector = chain()
+    assert detector.visit() == 3
+    assert detector.trace() == [lamp, double, detector]
+    # A change of the graph is seen by the compiled plans
+    other = Double()
+    lamp.connect(other)
+    other.connect(double)
+    assert detector.visit() == 5
+
+
+def test_nodes_collected():
+    nodes = chain()
+    nodes[2].visit()
+    refs = map(weakref.ref, nodes)
+    del nodes
+    gc.collect()
+    assert all(ref() is None for ref in refs)
+
+
+def test_unpickled_plan():
+    lamp, double, detector = chain()
+    detector.visit()
+    other = pickle.loads(pickle.dumps(detector, pickle.HIGHEST_PROTOCOL))
+    assert other.trace()[-1] is other
+    assert other.visit() == 3
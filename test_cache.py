@@ -0,0 +1,37 @@
+'''Caches of the derived products.'''
+
+from conectsim.cache import Cache, freeze
+
+
+def test_computed_once():
+    cache = Cache()
+    calls = []
+    def factory():
+        calls.append(1)
+        return 'value'
+    assert cache.get('a', factory) == 'value'
+    assert cache.get('a', factory) == 'value'
+    assert len(calls) == 1
+    assert cache.info() == (1, 1, 1)
+
+
+def test_least_recently_used():
+    cache = Cache(maxsize=2)
+    cache.get('a', lambda: 1)
+    cache.get('b', lambda: 2)
+    # 'a' is used again, 'b' is the least recently used
+    cache.get('a', lambda: None)
+    cache.get('c', lambda: 3)
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+    assert len(cache) == 2
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_freeze():
+    conf = {'vph': 'VPH1', 'cover': {'left': 1, 'right': 0}, 'reads': [1, 2]}
+    same = {'reads': [1, 2], 'cover': {'right': 0, 'left': 1}, 'vph': 'VPH1'}
+    assert freeze(conf) == freeze(same)
+    assert hash(freeze(conf)) == hash(freeze(same))
+    assert freeze(conf) != freeze(dict(conf, vph='VPH2'))
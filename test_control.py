@@ -0,0 +1,148 @@
+'''Runs of the control system.'''
+
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from conectsim.control import ControlSystem
+from conectsim.detector import CDetector
+from conectsim.devices.das import DataAdquisitionSystem
+from conectsim.devices.device import Device
+from conectsim.devices.wheel import Wheel
+from conectsim.devices.shutter import Shutter
+from conectsim.devices.cover import C_Cover
+from conectsim.factory import InsImageFactory
+
+
+class Instrument(Device):
+    '''The devices of MEGARA in the headers, without optics.'''
+    def __init__(self, seed=1, readout='single'):
+        super(Instrument, self).__init__(name='megara')
+        self.wheel = Wheel(2, name='wheel', parent=self)
+        self.wheel.put_in_pos('VPH1', 0)
+        self.wheel.put_in_pos('VPH2', 1)
+        self.shutter = Shutter(parent=self)
+        self.cover = C_Cover(parent=self)
+        self.detector = CDetector(40, 30, 15.0, 1.0, seed=seed)
+        self.detector.set_parent(self)
+        self.das = DataAdquisitionSystem(self.detector)
+        self.das.set_parent(self)
+        self.das.configure(readout)
+        self.image_factory = InsImageFactory()
+
+    def illumination(self):
+        return np.full((30, 40), 100.0)
+
+    def run(self, exptime):
+        self.detector.set_input(self.illumination())
+        for data in self.das.run(exptime):
+            yield [data]
+
+    def header(self, meta):
+        return self.image_factory.create_header(meta)
+
+    def factory(self, meta, data):
+        return self.image_factory.create(meta, data)
+
+
+def expected_frames(readout, exptime):
+    instrument = Instrument(readout=readout)
+    return [data[0].copy() for data in instrument.run(exptime)]
+
+
+def read_frame(filename):
+    with fits.open(filename) as hdul:
+        return hdul[0].data.astype('uint16'), hdul[0].header
+
+
+def test_int16_files(tmpdir):
+    cs = ControlSystem(str(tmpdir))
+    names = cs.run(Instrument(), 10.0)
+    assert names == ['r00001.fits']
+    data, header = read_frame(os.path.join(str(tmpdir), names[0]))
+    assert np.array_equal(data, expected_frames('single', 10.0)[0])
+    assert header['VPH'] == 'VPH1'
+
+
+def test_frames_reused(tmpdir):
+    ramp = {'mode': 'ramp', 'reads': 6}
+    cs = ControlSystem(str(tmpdir), max_frames=2)
+    instrument = Instrument(readout=ramp)
+    names = cs.run(instrument, 10.0)
+    assert len(names) == 6
+    # All the frames are back in the pool, none was allocated
+    assert cs.frame_pool(instrument).nframes == 2
+    assert cs.frame_pool(instrument)._free.qsize() == 2
+    assert instrument.das.frames is None
+    for name, frame in zip(names, expected_frames(ramp, 10.0)):
+        data, _ = read_frame(os.path.join(str(tmpdir), name))
+        assert np.array_equal(data, frame)
+
+
+def test_container_names(tmpdir):
+    cs = ControlSystem(str(tmpdir), output='container')
+    names = cs.run(Instrument(readout='cds'), 10.0)
+    assert names == [('c00001.fits', 'r00001.fits'), ('c00001.fits', 'r00002.fits')]
+    container, extension = cs.path(names[1])
+    assert container == os.path.join(str(tmpdir), 'c00001.fits')
+    with fits.open(container) as hdul:
+        assert hdul[extension].data.shape == (30, 40)
+
+
+def test_compressed_files(tmpdir):
+    cs = ControlSystem(str(tmpdir), output='compressed')
+    names = cs.run(Instrument(), 10.0)
+    with fits.open(os.path.join(str(tmpdir), names[0])) as hdul:
+        assert hdul[1].header['VPH'] == 'VPH1'
+        assert np.array_equal(hdul[1].data, expected_frames('single', 10.0)[0])
+
+
+def read_images(destdir, names):
+    images = []
+    for name in names:
+        if isinstance(name, tuple):
+            filename, extension = name
+        else:
+            # The image is the last HDU, also when compressed
+            filename, extension = name, -1
+        with fits.open(os.path.join(destdir, filename)) as hdul:
+            images.append(hdul[extension].data.astype('uint16'))
+    return images
+
+
+def test_parallel_as_serial(tmpdir):
+    for output in ['int16', 'fits', 'compressed', 'container']:
+        serial = tmpdir.mkdir('serial-' + output)
+        cs = ControlSystem(str(serial), output=output)
+        instrument = Instrument(readout='cds')
+        names = []
+        for _ in range(3):
+            names.extend(cs.run(instrument, 10.0))
+        # Continues with the following streams
+        names.extend(cs.run(instrument, 10.0))
+
+        parallel = tmpdir.mkdir('parallel-' + output)
+        pcs = ControlSystem(str(parallel), output=output)
+        pinstrument = Instrument(readout='cds')
+        pnames = pcs.parallel_run(pinstrument, 10.0, 3, 2)
+        pnames.extend(pcs.run(pinstrument, 10.0))
+
+        assert len(pnames) == 8
+        if output == 'container':
+            assert pnames[0] == ('c00001.fits', 'r00001.fits')
+        else:
+            assert pnames == names
+        for image, other in zip(read_images(str(serial), names),
+                                read_images(str(parallel), pnames)):
+            assert np.array_equal(image, other)
+        # The headers are built by the workers
+        for name in pnames[:6]:
+            if isinstance(name, tuple):
+                filename, extension = name
+            else:
+                filename, extension = name, -1
+            with fits.open(os.path.join(str(parallel), filename)) as hdul:
+                assert hdul[extension].header['VPH'] == 'VPH1'
+        # The temporary file is not in the destination
+        assert all(name.endswith('.fits') for name in os.listdir(str(parallel)))
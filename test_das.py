@@ -0,0 +1,27 @@
+'''Readout modes of the data adquisition system.'''
+
+import pytest
+
+from conectsim.devices.das import readout_mode
+
+
+def test_sequences():
+    assert list(readout_mode('single').sequence(10.0)) == [(0.0, 'reset'), (10.0, 'read')]
+    assert list(readout_mode('cds').sequence(10.0)) == [
+        (0.0, 'reset'), (0.0, 'read'), (10.0, 'read')]
+    ramp = readout_mode({'mode': 'ramp', 'reads': 3})
+    assert list(ramp.sequence(10.0)) == [
+        (0.0, 'reset'), (0.0, 'read'), (5.0, 'read'), (5.0, 'read')]
+    fowler = readout_mode({'mode': 'fowler', 'reads': 2, 'readtime': 1.0})
+    # 10 seconds between the first reads of each group
+    assert list(fowler.sequence(10.0)) == [
+        (0.0, 'reset'), (0.0, 'read'), (1.0, 'read'), (9.0, 'read'), (1.0, 'read')]
+
+
+def test_invalid_modes():
+    with pytest.raises(ValueError):
+        readout_mode('destructive')
+    with pytest.raises(ValueError):
+        readout_mode({'mode': 'ramp', 'reads': 1})
+    with pytest.raises(ValueError):
+        list(readout_mode({'mode': 'fowler', 'reads': 4, 'readtime': 5.0}).sequence(10.0))
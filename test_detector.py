@@ -0,0 +1,55 @@
+'''Noise of the detector.'''
+
+import threading
+
+import numpy as np
+
+from conectsim.detector import CDetector, NoiseModel
+
+
+def test_independent_of_threads():
+    rate = np.full((600, 50), 20.0)
+    images = []
+    for nthreads in [1, 3]:
+        noise = NoiseModel(seed=7, nthreads=nthreads, block_rows=128)
+        charge = np.zeros(rate.shape)
+        noise.add_charge(charge, rate, 10.0, 1)
+        out = np.empty(rate.shape, dtype='uint16')
+        noise.read(charge, 2, out)
+        images.append(out)
+    assert np.array_equal(images[0], images[1])
+
+
+def test_threads_end():
+    nthreads = threading.active_count()
+    noise = NoiseModel(seed=7, nthreads=3, block_rows=2)
+    charge = np.zeros((10, 4))
+    noise.add_charge(charge, np.full(charge.shape, 5.0), 1.0, 1)
+    assert threading.active_count() == nthreads
+
+
+def test_statistics():
+    noise = NoiseModel(gain=2.0, bias=500.0, ron=3.0, seed=1)
+    charge = np.zeros((200, 200))
+    noise.add_charge(charge, np.full(charge.shape, 100.0), 10.0, 1)
+    assert abs(charge.mean() - 1000.0) < 1.0
+    assert abs(charge.var() - 1000.0) < 30.0
+    out = np.empty(charge.shape, dtype='uint16')
+    noise.read(charge, 2, out)
+    assert abs(out.mean() - 1000.0) < 1.0
+
+
+def test_saturation():
+    noise = NoiseModel(fullwell=1000.0, bias=65000.0, seed=1)
+    charge = np.zeros((4, 4))
+    noise.add_charge(charge, np.full(charge.shape, 1e6), 1.0, 1)
+    assert np.all(charge == 1000.0)
+    out = np.empty(charge.shape, dtype='uint16')
+    noise.read(charge, 2, out)
+    assert np.all(out == 65535)
+
+
+def test_dark_exposure():
+    detector = CDetector(8, 4, 15.0, 1.0, dark=0.0, ron=0.0, bias=100.0, seed=2)
+    detector.set_input(None)
+    assert np.all(detector.expose(10.0) == 100)
@@ -0,0 +1,53 @@
+'''Versions and configuration of the devices.'''
+
+from conectsim.devices.device import Device
+from conectsim.devices.wheel import Wheel
+from conectsim.devices.cover import C_Cover
+
+
+def instrument():
+    root = Device(name='megara')
+    wheel = Wheel(3, name='wheel', parent=root)
+    wheel.put_in_pos('VPH1', 0)
+    wheel.put_in_pos('VPH2', 1)
+    wheel.put_in_pos('VPH1', 2)
+    C_Cover(parent=root)
+    return root, wheel
+
+
+def test_versions():
+    root, wheel = instrument()
+    before = root.version_vector()
+    wheel.select('VPH2')
+    after = root.version_vector()
+    assert after != before
+    assert root.version() > before[0]
+    # Not moving does not change the versions
+    wheel.select('VPH2')
+    assert root.version_vector() == after
+
+
+def test_config_info_cached():
+    root, wheel = instrument()
+    info = root.config_info()
+    assert info['wheel']['label'] == 'VPH1'
+    assert root.config_info() is info
+    wheel.select('VPH2')
+    other = root.config_info()
+    assert other is not info
+    assert other['wheel']['label'] == 'VPH2'
+    # Only the device that changed is rebuilt
+    assert other['cover'] is info['cover']
+
+
+def test_select_first_position():
+    root, wheel = instrument()
+    wheel.select('VPH2')
+    wheel.select('VPH1')
+    assert wheel.pos() == 0
+
+
+def test_configure():
+    root, wheel = instrument()
+    root.configure({'wheel': 1})
+    assert root.config_info()['wheel']['label'] == 'VPH2'
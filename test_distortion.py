@@ -0,0 +1,85 @@
+'''Distortion of the spectra over the detector.'''
+
+import numpy as np
+
+from conectsim.detector import CDetector
+from conectsim.optics.distortion import DistortionModel, Resampler
+
+
+def columns(nfibers, start, stop, size):
+    # Each fiber falls in a slightly different wavelength range
+    wavelength = np.linspace(start, stop, size)
+    return wavelength + 3.0 * np.arange(nfibers)[:, np.newaxis]
+
+
+def test_linear_spectra():
+    grid = np.linspace(4000.0, 5000.0, 1001)
+    data = np.vstack([grid * 0.01, 7.0 - grid * 0.001])
+    wavelength = columns(2, 4100.0, 4900.0, 50)
+    resampled = Resampler(grid, wavelength)(data)
+    assert np.allclose(resampled[0], wavelength[0] * 0.01)
+    assert np.allclose(resampled[1], 7.0 - wavelength[1] * 0.001)
+
+
+def test_no_flux_outside_grid():
+    grid = np.linspace(4000.0, 5000.0, 101)
+    wavelength = columns(1, 3900.0, 5100.0, 13)
+    resampled = Resampler(grid, wavelength)(np.ones((1, 101)))
+    assert resampled[0, 0] == 0.0 and resampled[0, -1] == 0.0
+    assert np.all(resampled[0, 1:-1] == 1.0)
+
+
+def test_flux_conserved():
+    grid = np.linspace(4000.0, 5000.0, 2001)
+    data = np.vstack([np.exp(-0.5 * ((grid - center) / 2.0) ** 2)
+                      for center in [4300.0, 4512.3, 4700.0]])
+    # Pixels much wider than the lines, inside the grid
+    wavelength = columns(3, 4050.0, 4900.0, 60)
+    resampler = Resampler(grid, wavelength, conserve_flux=True)
+    resampled = resampler(data)
+    flux = (resampled * resampler._width).sum(axis=1)
+    expected = np.sqrt(2 * np.pi) * 2.0
+    assert np.allclose(flux, expected, rtol=1e-6)
+
+    # Sampled in the centres of the pixels, the lines are lost
+    sampled = Resampler(grid, wavelength)(data)
+    assert not np.allclose((sampled * resampler._width).sum(axis=1), expected, rtol=0.1)
+
+
+def test_output_buffer():
+    grid = np.linspace(4000.0, 5000.0, 101)
+    wavelength = columns(2, 4100.0, 4900.0, 20)
+    resampler = Resampler(grid, wavelength, conserve_flux=True)
+    out = np.empty(resampler.shape)
+    assert resampler(np.ones((2, 101)), out=out) is out
+    assert np.allclose(out, 1.0)
+    assert np.allclose(resampler.dispersion[:, 0], np.diff(wavelength[:, :2]).ravel() / 10.0)
+
+
+class VPH(object):
+    '''Distortion interpolators of a VPH, counting the builds.'''
+    def __init__(self):
+        self.builds = 0
+        self.wavelength_distortion_interpolator = None
+        self.spatial_distortion_interpolator = None
+
+    def create_distortion_interpolators(self, detector, slit):
+        self.builds += 1
+        self.wavelength_distortion_interpolator = lambda x, y: 4000.0 + x + 0.0 * y
+        self.spatial_distortion_interpolator = lambda x, y: y + 0.0 * x
+
+
+def test_model_built_once():
+    vph = VPH()
+    detector = CDetector(10, 8, 15.0, 1.0)
+    model = DistortionModel(vph, detector, None)
+    positions = np.array([1.0, 3.0])
+    trace = model.trace_table('LCB', positions)
+    assert trace.shape == (2, 10)
+    assert np.all(trace[1] == 3.0)
+    assert model.trace_table('LCB', positions) is trace
+    grid = np.linspace(3990.0, 4020.0, 31)
+    resampler = model.resampler('LCB', positions, grid)
+    assert model.resampler('LCB', positions, grid) is resampler
+    assert model.resampler('LCB', positions, grid + 1.0) is not resampler
+    assert vph.builds == 1
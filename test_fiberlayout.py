@@ -0,0 +1,87 @@
+'''Fibers of the bundles and the flux of the targets.'''
+
+import numpy as np
+import pytest
+
+from conectsim.devices.cover import C_Cover
+from conectsim.optics.fiberlayout import FiberBundle
+
+
+def bundle():
+    # A fiber in the center and six around it
+    angles = np.arange(6) * np.pi / 3
+    positions = np.vstack([[0.0, 0.0], np.column_stack([np.cos(angles), np.sin(angles)])])
+    return FiberBundle('LCB', fiber_positions=positions, slit_positions=np.arange(7.0))
+
+
+def test_trace_bounds():
+    geometry = bundle().fiber_geometry(C_Cover())
+    # Three fibers, 2 rows apart, bending one row over the detector
+    trace = np.array([[10.0, 11.0], [12.0, 13.0], [14.0, 15.0]])
+    lower, upper = geometry.trace_bounds(trace)
+    assert np.allclose(lower, [9.0, 11.0, 13.0])
+    assert np.allclose(upper, [12.0, 14.0, 16.0])
+    # Also when the traces go down the detector
+    lower, upper = geometry.trace_bounds(trace[::-1])
+    assert np.allclose(lower, [13.0, 11.0, 9.0])
+    assert np.allclose(upper, [16.0, 14.0, 12.0])
+
+
+def gaussian(r2, sigma, area):
+    return area / (2 * np.pi * sigma ** 2) * np.exp(-0.5 * r2 / sigma ** 2)
+
+
+def test_target_weights():
+    fibers = bundle()
+    centers = [[0.0, 0.0], [10.0, 10.0], [0.5, 0.0]]
+    sigmas = [0.5, 0.5, 0.4]
+    weights = fibers.target_weights(centers, sigmas, 0.8).toarray()
+    assert weights.shape == (3, 7)
+    assert np.isclose(weights[0, 0], gaussian(0.0, 0.5, 0.8))
+    assert np.allclose(weights[0, 1:], gaussian(1.0, 0.5, 0.8))
+    # Far from the fibers
+    assert np.all(weights[1] == 0.0)
+    # Only the fibers within 5 sigmas, 2.0 from the center
+    r2 = ((fibers.fiber_positions - [0.5, 0.0]) ** 2).sum(axis=1)
+    expected = np.where(r2 <= 4.0, gaussian(r2, 0.4, 0.8), 0.0)
+    assert np.allclose(weights[2], expected)
+
+
+def test_nsigma():
+    weights = bundle().target_weights([[0.0, 0.0]], [0.5], 1.0, nsigma=1.5)
+    assert weights.nnz == 1
+
+
+def test_weights_reused():
+    fibers = bundle()
+    weights = fibers.target_weights([[0.0, 0.0]], [0.5], 1.0)
+    assert fibers.target_weights([[0.0, 0.0]], [0.5], 1.0) is weights
+    assert fibers.target_weights([[0.0, 0.0]], [0.6], 1.0) is not weights
+
+
+def test_fiber_flux():
+    fibers = bundle()
+    spectra = np.array([[1.0, 2.0], [3.0, 4.0]])
+    centers = [[0.0, 0.0], [1.0, 0.0]]
+    flux = fibers.fiber_flux(centers, [0.5, 0.5], spectra, 1.0)
+    weights = fibers.target_weights(centers, [0.5, 0.5], 1.0).toarray()
+    assert flux.shape == (7, 2)
+    assert np.allclose(flux, weights.T.dot(spectra))
+
+
+def test_load(tmpdir):
+    table = tmpdir.join('lcb.txt')
+    table.write('-1.0 0.0 10.0\n0.0 0.0 20.0\n1.0 0.0 30.0\n')
+    fibers = FiberBundle.load('LCB', str(table))
+    cover = C_Cover()
+    cover.set('UNSET')
+    geometry = fibers.fiber_geometry(cover)
+    assert np.array_equal(geometry.positions, [10.0, 20.0, 30.0])
+    assert np.array_equal(geometry.separation, [10.0, 10.0, 10.0])
+    cover.set('RIGHT')
+    assert np.array_equal(fibers.fiber_geometry(cover).positions, [30.0])
+
+
+def test_positions_required():
+    with pytest.raises(ValueError):
+        FiberBundle('MOS').target_weights([[0.0, 0.0]], [0.5], 1.0)
@@ -0,0 +1,19 @@
+'''Streaming of the frames into FITS files.'''
+
+import numpy as np
+from astropy.io import fits
+
+from conectsim.fitsout import write_int16
+
+
+def test_int16(tmpdir):
+    data = np.arange(0, 65536, 97, dtype='uint16')[:600].reshape(20, 30)
+    header = fits.Header([('VPH', 'VPH1')])
+    for memmap in [False, True]:
+        filename = str(tmpdir.join('r%d.fits' % memmap))
+        write_int16(filename, header, data, memmap=memmap, block_rows=7)
+        with fits.open(filename) as hdul:
+            assert hdul[0].header['VPH'] == 'VPH1'
+            assert hdul[0].data.dtype == np.uint16
+            assert np.array_equal(hdul[0].data, data)
+        assert tmpdir.join('r%d.fits' % memmap).size() % 2880 == 0
@@ -0,0 +1,57 @@
+'''Transmission of the optical elements.'''
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+from conectsim.detector import CDetector
+from conectsim.telescope import Telescope
+from conectsim.optics.obscond import Atmosphere
+from conectsim.optics.optelement import OpticalElement, Open, path_transmission
+from conectsim.optics.spectralcube import SpectralCube
+
+
+def cube():
+    wavelength = np.linspace(400.0, 900.0, 11)
+    return SpectralCube(np.full((3, 11), 2.0), wavelength)
+
+
+def test_curve():
+    element = OpticalElement(interp1d([400.0, 900.0], [0.5, 1.0]))
+    spectra = element.transform(cube())
+    expected = 2.0 * np.linspace(0.5, 1.0, 11)
+    assert np.allclose(spectra.data, expected[np.newaxis])
+    # The curve is sampled once in each grid
+    element.transform(cube())
+    assert element._curves.info() == (1, 1, 1)
+
+
+def test_constant_transmissions():
+    assert np.all(OpticalElement(0.25).transform(cube()).data == 0.5)
+    assert np.all(OpticalElement(-1.0).transform(cube()).data == 0.0)
+    assert np.all(Open().transform(cube()).data == 2.0)
+    image = np.ones((4, 4))
+    assert OpticalElement(0.25).transform(image) is image
+
+
+def test_detector_qe():
+    qe = interp1d([400.0, 900.0], [0.9, 0.1])
+    detector = CDetector(16, 8, 15.0, qe)
+    spectra = OpticalElement(detector.transmission_interp).transform(cube())
+    assert np.allclose(spectra.data[0], 2.0 * np.linspace(0.9, 0.1, 11))
+
+
+def test_path_transmission():
+    atmosphere = Atmosphere()
+    atmosphere.transmission_interp = interp1d([400.0, 900.0], [0.7, 0.9])
+    telescope = Telescope(10.0, interp1d([400.0, 900.0], [0.8, 0.6]))
+    atmosphere.connect(telescope)
+    # The elements in front of the telescope are in its trace
+    path = telescope.trace() + [OpticalElement(0.5), Open()]
+    assert path[0] is atmosphere
+
+    expected = cube()
+    for element in path:
+        element.transform(expected)
+    trans = path_transmission(path, expected.wavelength)
+    assert np.allclose(cube().data * trans, expected.data)
+    assert not trans.flags.writeable
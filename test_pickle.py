@@ -0,0 +1,95 @@
+'''Pickling of the devices of an instrument.'''
+
+import cPickle as pickle
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+import conectsim.pickling
+from conectsim.detector import CDetector
+from conectsim.devices.das import DataAdquisitionSystem
+from conectsim.devices.device import Device
+from conectsim.devices.wheel import Wheel
+from conectsim.devices.shutter import Shutter
+from conectsim.devices.cover import C_Cover
+from conectsim.optics.vph import VPHGrating
+from conectsim.optics.fiberlayout import FiberBundle
+from conectsim.telescope import Telescope
+
+
+def roundtrip(obj):
+    return pickle.loads(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+
+class Receiver(Device):
+    '''Connects to the signals of its children, like C_Device.'''
+    def __init__(self):
+        super(Receiver, self).__init__(name='receiver')
+        self.wheel = Wheel(2, name='wheel', parent=self)
+        self.wheel.put_in_pos(VPHGrating('VPH1'), 0)
+        self.wheel.put_in_pos(VPHGrating('VPH2'), 1)
+        self.vph = self.wheel.current()
+        self._connect_signals()
+
+    def _connect_signals(self):
+        self.wheel.changed.connect(self._update_vph)
+
+    def _update_vph(self, _):
+        self.vph = self.wheel.current()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._connect_signals()
+
+
+def test_interp1d():
+    x = np.linspace(0, 10, 11)
+    for kind in ['linear', 'nearest', 'cubic']:
+        interp = interp1d(x, x ** 2, kind=kind)
+        other = roundtrip(interp)
+        assert np.allclose(other([0.5, 3.3, 9.9]), interp([0.5, 3.3, 9.9]))
+
+
+def test_signals_connected_again():
+    receiver = roundtrip(Receiver())
+    assert receiver.vph.name == 'VPH1'
+    receiver.wheel.select('VPH2')
+    assert receiver.vph.name == 'VPH2'
+    assert len(receiver.wheel.changed.callbacks) == 1
+
+
+def test_das_runs_after_pickling():
+    detector = CDetector(16, 8, 15.0, 1.0, seed=3)
+    das = DataAdquisitionSystem(detector)
+    das.configure('cds')
+    detector.set_input(np.ones((8, 16)))
+    expected = [frame.copy() for frame in das.run(10.0)]
+
+    other = roundtrip(das)
+    assert other.detector is not detector
+    other.detector._stream = 0
+    frames = [frame.copy() for frame in other.run(10.0)]
+    assert len(frames) == 2
+    for frame, exp in zip(frames, expected):
+        assert np.array_equal(frame, exp)
+    assert other.meta['readmode'] == 'cds'
+
+
+def test_instrument_tree():
+    root = Receiver()
+    detector = CDetector(16, 8, 15.0, 1.0, seed=3)
+    detector.set_parent(root)
+    das = DataAdquisitionSystem(detector)
+    das.set_parent(root)
+    Shutter(parent=root)
+    C_Cover(parent=root)
+    bundle = FiberBundle('LCB', fiber_positions=np.zeros((3, 2)),
+                         slit_positions=np.arange(3.0))
+    telescope = Telescope(10.0, interp1d([300.0, 1000.0], [0.5, 0.9]))
+    telescope.connect(bundle)
+
+    other_root, other_telescope = roundtrip((root, telescope))
+    assert other_root.config_info() == root.config_info()
+    assert np.allclose(other_telescope.transmission_interp(500.0),
+                       telescope.transmission_interp(500.0))
+    assert other_telescope.nextnode.name == 'LCB'
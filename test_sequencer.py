@@ -0,0 +1,42 @@
+'''Ordering of the exposures of an observing block.'''
+
+import pytest
+
+from conectsim import sequencer
+from conectsim.sequencer import ExposureRequest, schedule
+
+
+def block(configurations, after=None):
+    after = after or {}
+    return [ExposureRequest({'vph': vph}, 10.0, after.get(idx, ()))
+            for idx, vph in enumerate(configurations)]
+
+
+def test_fewest_groups():
+    # Staying in VPH1 first needs three groups
+    requests = block(['VPH1', 'VPH2', 'VPH1', 'VPH2', 'VPH1'], {4: (1, 3)})
+    assert schedule(requests) == [[1, 3], [0, 2, 4]]
+
+
+def test_current_configuration():
+    requests = block(['VPH1', 'VPH2', 'VPH2'])
+    assert schedule(requests) == [[0], [1, 2]]
+    assert schedule(requests, {'vph': 'VPH2'}) == [[1, 2], [0]]
+
+
+def test_constraints():
+    requests = block(['VPH1', 'VPH2', 'VPH1'], {1: (0,), 2: (1,)})
+    assert schedule(requests) == [[0], [1], [2]]
+
+
+def test_greedy_fallback(monkeypatch):
+    monkeypatch.setattr(sequencer, 'MAX_STATES', 0)
+    requests = block(['VPH1', 'VPH2', 'VPH1', 'VPH2'])
+    assert schedule(requests) == [[0, 2], [1, 3]]
+
+
+def test_invalid_constraints():
+    with pytest.raises(ValueError):
+        schedule(block(['VPH1', 'VPH2'], {0: (1,), 1: (0,)}))
+    with pytest.raises(ValueError):
+        schedule(block(['VPH1'], {0: (3,)}))
@@ -0,0 +1,73 @@
+'''Signals of the devices.'''
+
+import gc
+import threading
+
+from conectsim.signal import Signal, batch
+
+
+class Receiver(object):
+    def __init__(self):
+        self.values = []
+
+    def receive(self, value):
+        self.values.append(value)
+
+
+def test_handles():
+    signal = Signal()
+    values = []
+    first = signal.connect(lambda value: values.append(('a', value)))
+    signal.connect(lambda value: values.append(('b', value)))
+    signal.delete(first)
+    signal.emit(1)
+    assert values == [('b', 1)]
+    assert len(signal.callbacks) == 1
+
+
+def test_receiver_not_kept_alive():
+    signal = Signal()
+    receiver = Receiver()
+    signal.connect(receiver.receive)
+    signal.emit(1)
+    assert receiver.values == [1]
+    del receiver
+    gc.collect()
+    assert signal.callbacks == []
+    signal.emit(2)
+    assert len(signal._slots) == 0
+
+
+def test_batch():
+    first, second = Signal(), Signal()
+    receiver = Receiver()
+    calls = []
+    first.connect(receiver.receive)
+    second.connect(receiver.receive)
+    second.connect(lambda value: calls.append(value))
+    with batch():
+        first.emit(1)
+        with batch():
+            second.emit(2)
+        # Deferred until the outermost block exits
+        assert receiver.values == []
+        first.emit(3)
+    # Once for each callback, with the last arguments
+    assert receiver.values == [3]
+    assert calls == [2]
+    first.emit(4)
+    assert receiver.values == [3, 4]
+
+
+def test_batch_per_thread():
+    signal = Signal()
+    receiver = Receiver()
+    signal.connect(receiver.receive)
+    with batch():
+        signal.emit(1)
+        # Another thread is not in the batch
+        thread = threading.Thread(target=signal.emit, args=(2,))
+        thread.start()
+        thread.join()
+        assert receiver.values == [2]
+    assert receiver.values == [2, 1]
@@ -0,0 +1,39 @@
+'''Flux of the gaussian targets in the fibers.'''
+
+import numpy as np
+
+from conectsim.devices.cover import C_Cover
+from conectsim.optics.fiberlayout import FiberBundle
+from conectsim.targets import GaussianTarget, GaussianTargetList, layout_flux
+
+
+def bundle():
+    # A hexagonal grid of fibers, 1 apart
+    x, y = np.meshgrid(np.arange(-6, 7), np.arange(-6, 7))
+    positions = np.column_stack([(x + 0.5 * (y % 2)).ravel(), (y * np.sqrt(3) / 2).ravel()])
+    return FiberBundle('LCB', fiber_positions=positions,
+                       slit_positions=np.arange(len(positions), dtype='float'))
+
+
+def test_fast_as_dense():
+    fibers = bundle()
+    spectra = np.random.RandomState(1).uniform(1.0, 2.0, size=(3, 10))
+    targets = GaussianTargetList([GaussianTarget([0.0, 0.0], 0.3, spectra[0]),
+                                  GaussianTarget([2.5, -1.0], 0.0, spectra[1]),
+                                  GaussianTarget([-3.0, 2.0], 1.0, spectra[2])])
+    area = 0.5 * 3 * np.sqrt(3) * 0.5 ** 2
+    cover = C_Cover()
+    cover.set('UNSET')
+    mask = fibers.fiber_geometry(cover).mask
+    flux = layout_flux(fibers, targets, 0.8, area)[mask]
+    dense = targets.dense_flux(fibers.fiber_positions, area, 0.8)[mask]
+    assert flux.shape == (len(fibers.fiber_positions), 10)
+    # Only the tails beyond 5 sigmas are missing
+    assert np.allclose(flux, dense, rtol=0.0, atol=1e-5 * dense.max())
+    assert np.count_nonzero(flux) < flux.size
+
+
+def test_seeing():
+    target = GaussianTarget([1.0, 2.0], 0.3, [1.0])
+    _, sigma, _ = target.gaussian(0.4 * np.sqrt(8 * np.log(2)))
+    assert np.isclose(sigma, 0.5)
@@ -0,0 +1,60 @@
+'''Metadata of the images.'''
+
+import cPickle as pickle
+
+from conectsim.factory import InsImageFactory
+from conectsim.treedict import TreeDict
+
+
+def meta():
+    tree = TreeDict()
+    tree['ob'] = {'object': 'M31', 'mode': 'ENGINEERING'}
+    tree['control'] = {'name': 'SIMULATOR', 'runid': 1, 'date': '0'}
+    tree['megara'] = {'wheel': {'label': 'VPH1'}, 'shutter': {'label': 'OPEN'},
+                      'cover': {'label': 'SET'}}
+    return tree
+
+
+def test_dotted_keys():
+    tree = meta()
+    tree['ob.object'] = 'M33'
+    assert tree['ob'] == {'object': 'M33', 'mode': 'ENGINEERING'}
+    assert 'megara.wheel.label' in tree
+    assert 'megara.wheel.name' not in tree
+    assert tree.get('a.b', 3) == 3
+    del tree['ob.mode']
+    assert tree['ob'] == {'object': 'M33'}
+
+
+def test_snapshot_copy_on_write():
+    tree = meta()
+    snap = tree.snapshot()
+    # The branches are shared until modified
+    assert snap['megara'] is tree['megara']
+    snap['ob.object'] = 'M33'
+    tree['megara.wheel.label'] = 'VPH2'
+    assert tree['ob.object'] == 'M31'
+    assert snap['megara.wheel.label'] == 'VPH1'
+    assert snap['control'] is tree['control']
+
+
+def test_pickle():
+    tree = meta()
+    tree.snapshot()
+    other = pickle.loads(pickle.dumps(tree, pickle.HIGHEST_PROTOCOL))
+    other['ob.object'] = 'M33'
+    assert other['ob.object'] == 'M33'
+    assert tree['ob.object'] == 'M31'
+
+
+def test_header_updated():
+    factory = InsImageFactory()
+    tree = meta()
+    header = factory.create_header(tree)
+    assert header['VPH'] == 'VPH1'
+    assert header['OBJECT'] == 'M31'
+    tree['megara.wheel.label'] = 'VPH2'
+    other = factory.create_header(tree)
+    assert other['VPH'] == 'VPH2'
+    # The headers returned are copies
+    assert header['VPH'] == 'VPH1'
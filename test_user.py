@@ -0,0 +1,45 @@
+'''Loading of the configuration files.'''
+
+import os
+
+from conectsim.user import load_yaml, save_megara_in_cache, load_megara_from_cache
+
+
+def write(tmpdir, text):
+    filename = tmpdir.join('conf.yaml')
+    filename.write(text)
+    return str(filename)
+
+
+def test_cached_in_private_dir(tmpdir, monkeypatch):
+    cache = tmpdir.join('cache')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(cache))
+    data = tmpdir.mkdir('data')
+    filename = write(data, 'a: 1\n---\nb: 2\n')
+    assert load_yaml(filename) == [{'a': 1}, {'b': 2}]
+    # Nothing is written next to the file
+    assert os.listdir(str(data)) == ['conf.yaml']
+    cached = os.listdir(str(cache.join('conectsim')))
+    assert len(cached) == 1
+    assert os.stat(str(cache.join('conectsim'))).st_mode & 0o777 == 0o700
+
+    assert load_yaml(filename) == [{'a': 1}, {'b': 2}]
+    write(data, 'a: 3\n')
+    assert load_yaml(filename) == [{'a': 3}]
+
+
+def test_shared_dir_not_used(tmpdir, monkeypatch):
+    cache = tmpdir.mkdir('cache')
+    cache.mkdir('conectsim').chmod(0o777)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(cache))
+    filename = write(tmpdir, 'a: 1\n')
+    assert load_yaml(filename) == [{'a': 1}]
+    assert cache.join('conectsim').listdir() == []
+
+
+def test_instrument_not_loaded_from_shared_dir(tmpdir):
+    cache = str(tmpdir.join('conectsim'))
+    save_megara_in_cache(cache, 'jash', {'name': 'megara'})
+    assert load_megara_from_cache(cache, 'jash') == {'name': 'megara'}
+    os.chmod(cache, 0o777)
+    assert load_megara_from_cache(cache, 'jash') is None
@@ -0,0 +1,51 @@
+'''Background writing of the files.'''
+
+import threading
+
+import numpy as np
+
+from conectsim.writer import WriterPool, FramePool
+
+
+def test_written_and_reported():
+    done = []
+    written = []
+    pool = WriterPool(nworkers=2, maxsize=1,
+                      callback=lambda name, error: done.append((name, error)))
+    for idx in range(5):
+        pool.submit('f%d' % idx, written.append, idx)
+    assert pool.flush() == []
+    assert sorted(written) == range(5)
+    assert sorted(done) == [('f%d' % idx, None) for idx in range(5)]
+    assert pool.close() == []
+
+
+def test_errors():
+    def fail():
+        raise IOError('disk full')
+    pool = WriterPool(nworkers=1)
+    pool.submit('good', lambda: None)
+    pool.submit('bad', fail)
+    errors = pool.flush()
+    assert [name for name, _ in errors] == ['bad']
+    assert isinstance(errors[0][1], IOError)
+    # Reported once
+    assert pool.close() == []
+
+
+def test_frame_pool():
+    frames = FramePool((4, 3), 'uint16', 2)
+    first = frames.get()
+    second = frames.get()
+    assert first.shape == (4, 3) and first.dtype == np.uint16
+    assert first is not second
+
+    got = []
+    waiting = threading.Thread(target=lambda: got.append(frames.get()))
+    waiting.start()
+    waiting.join(0.1)
+    # No frame is free
+    assert waiting.is_alive()
+    frames.release(second)
+    waiting.join(1.0)
+    assert got[0] is second